@@ -1,119 +1,731 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import os
+from urllib.parse import urlparse
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import time
+import asyncio
+from collections import Counter
+from selenium.common.exceptions import TimeoutException
+from fetcher import DEFAULT_CONCURRENCY, BROWSER_RETRY_STATUSES, create_session, fetch_html, looks_js_rendered
+from frontier import Frontier, domain_allowed, domain_host
+from driver_pool import DriverPool
+from extraction import extract_page
+from extraction_pool import ExtractionPool
+from page_store import PageStore
+from page_cache import PageCache, body_hash
+from politeness import HostQueues, HostScheduler
+from dedupe import NearDuplicateIndex, simhash
+from sitemap import iter_sitemap_entries
+from checkpoint import CrawlCheckpoint
+from content_guard import ContentGuard, DEFAULT_MAX_RENDER_SECONDS
+from url_registry import LinkLog, UrlSet
+from metrics import span, current_trace, PAGES, BYTES, ERRORS, CACHE_REQUESTS
 
-def setup_driver():
-    """Set up and return a Chrome WebDriver instance."""
+# Requests the analyzer never needs: images, media, fonts and common trackers
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico', '*.bmp',
+    '*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m4a', '*.mov',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*connect.facebook.net*', '*hotjar.com*', '*segment.com*', '*clarity.ms*',
+    '*hubspot.com*', '*linkedin.com/px*', '*ads-twitter.com*'
+]
+
+def setup_driver(lean=True, page_load_timeout=DEFAULT_MAX_RENDER_SECONDS):
+    """
+    Set up and return a Chrome WebDriver instance.
+
+    With lean=True (the default) pages load with the "eager" strategy and
+    images, media, fonts and analytics requests are blocked through the
+    Chrome DevTools protocol, since only the DOM text and links are used.
+    Page loads taking longer than `page_load_timeout` seconds are aborted.
+    """
     chrome_options = Options()
     chrome_options.add_argument('--headless')  # Run in headless mode
     chrome_options.add_argument('--no-sandbox')
     chrome_options.add_argument('--disable-dev-shm-usage')
+    if lean:
+        # Return control once the DOM is parsed instead of waiting for every subresource
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2
+        })
     
     # Initialize the Chrome WebDriver
     driver = webdriver.Chrome(options=chrome_options)
+    driver.set_page_load_timeout(page_load_timeout)
+
+    if lean:
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+        except Exception as e:
+            print(f"Warning: Could not enable request blocking: {e}")
     return driver
 
 def is_allowed_domain(url, allowed_domains):
-    """Check if the URL's domain is in the allowed domains list."""
+    """Check if the URL's host is one of the allowed domains or a subdomain of one."""
     if not allowed_domains:
         return True
-    domain = urlparse(url).netloc
-    return any(domain.endswith(d) for d in allowed_domains)
+    return domain_allowed(url, [domain_host(d) for d in allowed_domains])
+
+# Script returning the signals used to decide that a page has settled
+_READY_STATE_SCRIPT = """
+return [
+    document.readyState,
+    document.getElementsByTagName('*').length,
+    performance.getEntriesByType('resource').length
+];
+"""
+
+def wait_for_page_ready(driver, timeout=10, quiet_period=0.5, poll_interval=0.1):
+    """
+    Wait until the page is parsed and has stopped changing.
+
+    The page counts as ready once document.readyState is past "loading" and
+    neither the number of DOM elements nor the number of network requests
+    has changed for `quiet_period` seconds (DOM stable and network idle).
+
+    Returns:
+        True if the page settled before the timeout, False otherwise.
+    """
+    deadline = time.monotonic() + timeout
+    last_snapshot = None
+    stable_since = None
+
+    while time.monotonic() < deadline:
+        try:
+            ready_state, element_count, request_count = driver.execute_script(_READY_STATE_SCRIPT)
+        except Exception:
+            ready_state, element_count, request_count = 'loading', None, None
+
+        now = time.monotonic()
+        snapshot = (element_count, request_count)
+        if ready_state == 'loading' or snapshot != last_snapshot:
+            last_snapshot = snapshot
+            stable_since = now
+        elif now - stable_since >= quiet_period:
+            return True
+        time.sleep(poll_interval)
+
+    return False
+
+def render_page(driver, url, trace=None, max_seconds=None):
+    """
+    Load a URL in the browser and return its rendered HTML; spans go to
+    `trace` if given. With `max_seconds`, waiting for the page to settle
+    stops once that much time has passed since the load began.
+    """
+    print(f"Fetching page content for {url}...")
+    started = time.monotonic()
+    with span('render', trace, url=url):
+        driver.get(url)
+
+    timeout = 10
+    if max_seconds is not None:
+        timeout = max(min(timeout, max_seconds - (time.monotonic() - started)), 0)
+    with span('render_wait', trace, url=url):
+        ready = wait_for_page_ready(driver, timeout=timeout)
+    if ready:
+        print("Page loaded successfully")
+    else:
+        print("Warning: Timeout waiting for page to settle")
+
+    return driver.page_source
+
+class CrawlState:
+    """Mutable state shared by the browser and static crawl loops."""
+
+    def __init__(self, frontier, visited, driver_pool, scheduler, allowed_tags=None, page_store=None,
+                 page_cache=None, cancel_check=None, on_event=None, lastmod=None, checkpoint=None,
+                 extractor=None, guard=None, skipped=None, on_page=None):
+        self.frontier = frontier
+        self.scheduler = scheduler
+        self.queues = HostQueues(frontier, scheduler, skipped=skipped)
+        self.queues.on_skip = lambda url, reason: self.emit('page_skipped', url=url, reason=reason)
+        self.guard = guard if guard is not None else ContentGuard()
+        self.visited = visited
+        self.driver_pool = driver_pool
+        self.allowed_tags = allowed_tags
+        self.page_cache = page_cache
+        # Append-only log of every in-scope URL the frontier has seen
+        self.all_links = frontier.links
+        self.content_map = page_store if page_store is not None else {}
+        self.duplicates = NearDuplicateIndex()
+        self.cancel_check = cancel_check
+        self.on_event = on_event
+        self.on_page = on_page
+        # Canonical URL -> sitemap lastmod timestamp, for incremental crawls
+        self.lastmod = lastmod or {}
+        self.checkpoint = checkpoint
+        # ExtractionPool parsing pages while others are fetched; None parses inline in add_page
+        self.extractor = extractor
+        # Set when continuing from a checkpoint: pages stored after it are not fetched again
+        self.resumed = False
+        # Renders run on pool threads, which the task's trace context does not reach
+        self.trace = current_trace()
+
+    def check_cancelled(self):
+        """Let the caller abort the crawl between batches by raising from cancel_check."""
+        if self.cancel_check is not None:
+            self.cancel_check()
+
+    def emit(self, event, **data):
+        """Report crawl progress to the on_event hook, if any."""
+        if self.on_event is not None:
+            self.on_event(event, **data)
+
+    def snapshot(self):
+        """Crawl state for a checkpoint; only consistent between batches."""
+        return {
+            'frontier': self.frontier.snapshot(self.queues.pending_items()),
+            'visited': self.visited.to_state() if isinstance(self.visited, UrlSet) else list(self.visited),
+            'skipped': [list(item) for item in self.queues.skipped],
+            'lastmod': self.lastmod,
+        }
+
+    def save_checkpoint(self, stage='crawling', force=False):
+        """Write a checkpoint if one is configured and the interval has passed (or `force`)."""
+        if self.checkpoint is not None and (force or self.checkpoint.due()):
+            with span('checkpoint'):
+                self.checkpoint.save(stage=stage, crawl=self.snapshot())
+
+    def restore(self, state):
+        """Continue from a checkpoint snapshot; the frontier is restored by the caller."""
+        if isinstance(state['visited'], str):
+            if isinstance(self.visited, UrlSet):
+                self.visited.load_state(state['visited'])
+        else:
+            self.visited.update(state['visited'])
+        self.queues.skipped.extend(tuple(item) for item in state['skipped'])
+        # Rebuild the near-duplicate index from the pages already stored
+        for url, doc in self.content_map.items():
+            if doc.duplicate_of:
+                self.duplicates.clusters[doc.duplicate_of].append(url)
+            elif doc.simhash:
+                self.duplicates.add(doc.simhash, url)
+        self.resumed = True
+
+    def take_stored(self, batch):
+        """
+        On a resumed crawl, complete the pages of a batch that were stored
+        after the last checkpoint by following their links again, and
+        return the rest of the batch to fetch.
+        """
+        if not self.resumed:
+            return batch
+        remaining = []
+        for url, depth in batch:
+            doc = self.content_map.get(url)
+            if doc is None:
+                remaining.append((url, depth))
+                continue
+            self.visited.add(url)
+            if not doc.duplicate_of:
+                for absolute_url in doc.links:
+                    self.frontier.add(absolute_url, depth + 1)
+        return remaining
+
+    def start_batch(self, batch):
+        self.visited.update(url for url, _ in batch)
+        self.emit('batch', size=len(batch), depth=batch[0][1], visited=len(self.visited), queued=len(self.queues))
+
+    def page_fetched(self, url, html, source):
+        """Count a page that arrived from the network, the browser or the cache and report it."""
+        PAGES.inc(source=source)
+        BYTES.inc(len(html), source=source)
+        self.emit('page_fetched', url=url, cached=source == 'cache')
+
+    def cached(self, url):
+        """Return the page cache entry for a URL, or None."""
+        if self.page_cache is None:
+            return None
+        entry = self.page_cache.get(url, self.allowed_tags)
+        if entry is None:
+            CACHE_REQUESTS.inc(cache='page', result='miss')
+        else:
+            CACHE_REQUESTS.inc(cache='page', result='hit' if self.is_fresh(entry) else 'stale')
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Whether a cached page can be used without asking the server. When
+        the sitemap gives the page's lastmod, that decides instead of the
+        cache TTL: unchanged pages are reused, changed ones fetched again.
+        """
+        if entry is None:
+            return False
+        modified = self.lastmod.get(entry.url)
+        if modified is not None:
+            return modified <= entry.fetched_at
+        return self.page_cache.is_fresh(entry)
+
+    def skip(self, url, reason):
+        print(f"Skipping {url}: {reason}")
+        self.queues.skip(url, reason)
+
+    def render(self, driver, url):
+        """
+        Render a page in the browser within the host's politeness limits.
+        Non-HTML resources, oversized pages and pages that take longer than
+        the guard's max_render_seconds are skipped.
+
+        Returns:
+            (html, URL the browser ended up on), or (None, None) if skipped.
+        """
+        reason = self.guard.probe(url, self.scheduler)
+        if reason:
+            self.skip(url, reason)
+            return None, None
+        self.scheduler.acquire_sync(url)
+        started = time.monotonic()
+        try:
+            html = render_page(driver, url, self.trace, self.guard.max_render_seconds)
+        except TimeoutException:
+            self.skip(url, f"render timeout: over {self.guard.max_render_seconds}s")
+            return None, None
+        finally:
+            self.scheduler.release(url, elapsed=time.monotonic() - started)
+        if html and len(html) > self.guard.max_bytes:
+            self.skip(url, f"too large: {len(html)} characters rendered")
+            return None, None
+        return html, driver.current_url
+
+    def render_and_extract(self, driver, url, cached=None):
+        """
+        Render a page and hand it to the extraction pool while the next one
+        renders. Returns (html, base URL, PendingExtraction or None).
+        """
+        html, base_url = self.render(driver, url)
+        return html, base_url, self.start_extraction(url, html, cached, base_url) if html else None
+
+    def needs_extraction(self, html, cached=None):
+        """False without a pool, or when add_page will reuse the cached document of an unchanged body."""
+        if self.extractor is None:
+            return False
+        return cached is None or cached.document is None or cached.body_hash != body_hash(html)
 
-def crawl_and_scrape(start_url, max_depth=3, current_depth=0, visited=None, driver=None, allowed_domains=None):
+    def start_extraction(self, url, html, cached=None, base_url=None):
+        """
+        Submit a page to the extraction pool as soon as it arrives, ahead of
+        add_page. Returns None without a pool, or when add_page will reuse
+        the cached document because the body is unchanged.
+        """
+        if not self.needs_extraction(html, cached):
+            return None
+        return self.extractor.submit(url, html, self.allowed_tags, base_url)
+
+    async def start_extraction_async(self, url, html, cached=None, base_url=None):
+        """start_extraction() for the static crawl, waiting for pool capacity without blocking the event loop."""
+        if not self.needs_extraction(html, cached):
+            return None
+        return await self.extractor.submit_async(url, html, self.allowed_tags, base_url)
+
+    def add_page(self, url, depth, html, cached=None, etag=None, last_modified=None, refresh_cache=True,
+                 extraction=None, base_url=None):
+        """
+        Parse a fetched page once, store its document and queue its links.
+        Pages that near-duplicate an earlier page are stored with
+        `duplicate_of` set and their links are not followed.
+
+        When `cached` holds the same body, its extracted document is reused
+        instead of parsing again. New or changed pages are written to the
+        page cache; `refresh_cache=False` leaves a reused entry untouched.
+        `extraction` is the page's PendingExtraction from start_extraction;
+        pages are added in frontier order whatever order workers finish in.
+        Relative links resolve against `base_url`, the URL the page was
+        served from after redirects, when given.
+        """
+        doc = None
+        unchanged = cached is not None and cached.body_hash == body_hash(html)
+        if unchanged:
+            doc = cached.document
+            if doc is not None and refresh_cache:
+                self.page_cache.mark_revalidated(url)
+            if etag is None and last_modified is None:
+                # Same body (a 304 or a fresh entry): keep the validators it was cached with
+                etag, last_modified = cached.etag, cached.last_modified
+        if doc is None:
+            if extraction is not None:
+                doc = extraction.result(self.trace)
+            else:
+                doc = extract_page(url, html, self.allowed_tags, base_url)
+            if self.page_cache is not None:
+                self.page_cache.put(url, html, doc, self.allowed_tags, etag, last_modified)
+
+        if not doc.simhash:
+            # Missing, or 0 from a cache entry written before near-empty pages
+            # went without a fingerprint
+            doc.simhash = simhash(doc.text)
+        doc.duplicate_of = self.duplicates.check(doc.simhash, url)
+
+        self.content_map[url] = doc
+        if self.on_page is not None:
+            self.on_page(doc)
+        if doc.duplicate_of:
+            # Same content as an earlier page: its links were already followed there
+            print(f"Near-duplicate of {doc.duplicate_of}; not following its links")
+        else:
+            print(f"Found {len(doc.links)} links on this page")
+            for absolute_url in doc.links:
+                self.frontier.add(absolute_url, depth + 1)
+
+        self.emit('page_parsed', url=url, pages=len(self.content_map), discovered=len(self.all_links),
+                  queued=len(self.queues), duplicate=bool(doc.duplicate_of))
+        return doc
+
+def crawl_and_scrape(start_url, max_depth=3, current_depth=0, visited=None, driver=None, allowed_domains=None,
+                     mode="browser", concurrency=DEFAULT_CONCURRENCY, max_pages=None, driver_pool=None,
+                     allowed_tags=None, page_store=None, page_cache=None, scheduler=None, cancel_check=None,
+                     on_event=None, use_sitemap=False, incremental=False, checkpoint=None, bloom_capacity=None,
+                     extractor=None, content_guard=None, skipped=None, on_page=None):
     """
-    Crawls a website, scrapes all links that are part of the allowed domains.
+    Crawls a website breadth-first, scraping all links that are part of the allowed domains.
 
     Args:
         start_url: The URL to start crawling from.
         max_depth: The maximum depth to crawl.
-        current_depth: The current depth of the crawl (used for recursion).
-        visited: A set of visited URLs to avoid duplicates and loops.
-        driver: The Selenium WebDriver instance.
+        current_depth: The depth assigned to start_url.
+        visited: A set of already visited URLs to skip; it is updated with
+            every URL fetched during this crawl. When not given, fetched URLs
+            are tracked as fingerprints only.
+        driver: The Selenium WebDriver instance (optional).
         allowed_domains: List of allowed domains to crawl (optional).
+        mode: "browser" renders every page in Chrome; "static" fetches pages
+            concurrently over plain HTTP and only falls back to the browser
+            for pages that look JavaScript-rendered or answer 403.
+        concurrency: Maximum number of concurrent requests in static mode.
+        max_pages: Maximum number of pages to fetch (optional).
+        driver_pool: A shared DriverPool to render pages in parallel
+            (optional). Takes precedence over `driver`; when neither is
+            given a browser is started on demand and quit afterwards.
+        allowed_tags: Tags whose text goes into each page's filtered_text
+            (optional, see extraction.get_allowed_tags).
+        page_store: A PageStore that receives each page as soon as it is
+            extracted (optional). When given it is returned in place of the
+            in-memory dict, keeping memory use flat on large sites.
+        page_cache: A PageCache consulted before the network or the browser
+            (optional). Fresh pages are reused as-is, stale ones are
+            revalidated with conditional requests in static mode.
+        scheduler: A HostScheduler enforcing per-host rate limits, robots.txt
+            and backoff (optional). Share one across crawls so concurrent
+            tasks on the same site are throttled together.
+        cancel_check: A callable run before each batch of pages (optional).
+            Whatever it raises stops the crawl and propagates to the caller.
+        on_event: A callable on_event(event, **data) receiving progress
+            events (optional): 'batch' when a batch of URLs starts,
+            'page_fetched' when a page arrives from the network, browser or
+            cache, and 'page_parsed' once it is extracted; 'sitemap' once the
+            sitemap has seeded the frontier; 'page_skipped' with the url and
+            reason for each URL left out.
+        use_sitemap: Seed the frontier with the pages listed in the site's
+            sitemaps (from robots.txt, or /sitemap.xml) before crawling, so
+            pages are found without rendering their parents first.
+        incremental: With use_sitemap and a page_cache, decide from each
+            page's sitemap lastmod whether it changed since it was cached:
+            unchanged pages are reused however old, changed ones refetched.
+        checkpoint: A CrawlCheckpoint the crawl state is saved to between
+            batches and at the end (optional; needs a page_store). If it
+            holds the state of an interrupted crawl, the crawl continues from
+            there: completed pages are read from page_store instead of being
+            fetched again, and a crawl that had finished is not rerun.
+        bloom_capacity: Keep links beyond max_depth, which are never fetched,
+            in a Bloom filter sized for this many URLs instead of the exact
+            fingerprint set (optional; saves memory on very large sites).
+        extractor: An ExtractionPool whose worker processes parse pages
+            while the crawl fetches and renders the next ones (optional).
+            Documents are still added in frontier order. Without one pages
+            are parsed inline, between fetches.
+        content_guard: A ContentGuard screening URLs by extension and
+            headers so non-HTML resources and pages over its max_bytes are
+            neither rendered nor parsed, and capping render time (optional;
+            share one to share its per-URL verdicts).
+        skipped: A list that receives a (url, reason) pair for every URL
+            left out of the crawl: robots.txt, rate limited, extension,
+            content type, too large or render timeout (optional).
+        on_page: A callable on_page(doc) receiving each PageDocument as soon
+            as it is stored, near-duplicates included (optional). Pages
+            restored from a checkpoint are not passed again.
 
     Returns:
-        A tuple containing (set of unique URLs, dict of URL to HTML content mappings)
+        A tuple containing (iterable log of the unique in-scope URLs discovered,
+        dict-like mapping of URL to PageDocument). The log is a LinkLog
+        backed by a temporary file, or by the checkpoint's links file when
+        checkpointing; close it when done.
     """
+
+    if checkpoint is not None and page_store is None:
+        raise ValueError("Checkpointed crawls need a page_store to keep completed pages")
+    saved_state = checkpoint.data.get('crawl') if checkpoint is not None else None
+
+    links = None
+    if checkpoint is not None:
+        # Kept next to the checkpoint, which only records how far it was written
+        links_state = saved_state['frontier']['links'] if saved_state else None
+        links = LinkLog(checkpoint.links_path, links_state if isinstance(links_state, dict) else None)
+    frontier = Frontier(max_depth=max_depth, max_pages=max_pages, allowed_domains=allowed_domains,
+                        bloom_capacity=bloom_capacity, links=links)
+    if saved_state:
+        frontier.restore(saved_state['frontier'])
     if visited is None:
-        visited = set()
+        visited = UrlSet()
+    else:
+        for url in visited:
+            frontier.mark_seen(url)
+    if not saved_state:
+        frontier.add(start_url, current_depth)
 
-    # Add progress logging
-    print(f"\nCrawling: {start_url}")
-    print(f"Current depth: {current_depth}/{max_depth}")
-    print(f"Total URLs visited so far: {len(visited)}")
+    owns_pool = driver_pool is None
+    if driver_pool is None:
+        if driver is not None:
+            driver_pool = DriverPool.from_driver(driver)
+        else:
+            driver_pool = DriverPool(setup_driver, size=1)
+
+    if scheduler is None:
+        scheduler = HostScheduler()
 
-    if current_depth > max_depth or start_url in visited:
-        return set(), {}
+    lastmod = saved_state['lastmod'] if saved_state else {}
+    if use_sitemap and not saved_state:
+        if incremental and page_cache is None:
+            print("Incremental crawl needs a page cache; fetching every page")
+        seeded = 0
+        with span('sitemap'):
+            for url, modified in iter_sitemap_entries(start_url, scheduler.robots, scheduler):
+                canonical = frontier.add(url, current_depth + 1)
+                if canonical is None:
+                    continue
+                seeded += 1
+                if incremental and modified is not None:
+                    lastmod[canonical] = modified
+                # Entries beyond the page budget would never be fetched
+                if max_pages is not None and len(frontier) >= max_pages:
+                    break
+        print(f"Found {seeded} in-scope URLs in the sitemap")
+        if on_event is not None:
+            on_event('sitemap', urls=seeded, with_lastmod=len(lastmod))
 
-    visited.add(start_url)
-    all_links = set()
-    content_map = {}
+    crawl = CrawlState(frontier, visited, driver_pool, scheduler, allowed_tags=allowed_tags,
+                       page_store=page_store, page_cache=page_cache, cancel_check=cancel_check,
+                       on_event=on_event, lastmod=lastmod, checkpoint=checkpoint, extractor=extractor,
+                       guard=content_guard, skipped=skipped, on_page=on_page)
+    if saved_state:
+        crawl.restore(saved_state)
+        if checkpoint.reached('crawled'):
+            print(f"Crawl already finished: {len(crawl.content_map)} pages restored from the checkpoint")
+            if owns_pool:
+                driver_pool.close()
+            return crawl.all_links, crawl.content_map
+        print(f"Resuming crawl: {len(crawl.content_map)} pages done, {len(crawl.queues)} queued")
 
     try:
-        print(f"Fetching page content for {start_url}...")
-        driver.get(start_url)
-        
-        # Wait for page load with reduced timeout
-        try:
-            wait = WebDriverWait(driver, 10)
-            wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-            print("Page loaded successfully")
-        except Exception as e:
-            print(f"Warning: Timeout waiting for page load: {e}")
-        
-        page_source = driver.page_source
-        if page_source:
-            print(f"Retrieved {len(page_source)} characters of HTML")
-            content_map[start_url] = page_source
-        else:
-            print("Warning: Empty page source received")
-
-        # Parse with BeautifulSoup
-        soup = BeautifulSoup(page_source, "html.parser")
-
-        # Find and log number of links
-        links = soup.find_all("a")
-        print(f"Found {len(links)} links on this page")
-
-        for link in links:
-            href = link.get("href")
-            if href:
-                absolute_url = urljoin(start_url, href)
-                parsed_url = urlparse(absolute_url)
-                
-                # Check if URL is allowed
-                if (parsed_url.scheme in ("http", "https") and 
-                    is_allowed_domain(absolute_url, allowed_domains)):
-                    all_links.add(absolute_url)
-                    if current_depth < max_depth:
-                        new_links, new_content = crawl_and_scrape(
-                            absolute_url, 
-                            max_depth, 
-                            current_depth + 1, 
-                            visited, 
-                            driver,
-                            allowed_domains
-                        )
-                        all_links.update(new_links)
-                        content_map.update(new_content)
-                    
-    except Exception as e:
-        print(f"Error crawling {start_url}: {e}")
+        with span('crawl', mode=mode):
+            if mode == "static":
+                asyncio.run(_crawl_static(crawl, concurrency))
+            else:
+                _crawl_browser(crawl)
+        crawl.save_checkpoint('crawled', force=True)
+    except BaseException:
+        # The link log is only handed to the caller on success
+        crawl.all_links.close()
+        raise
+    finally:
+        if owns_pool:
+            driver_pool.close()
+
+    if crawl.duplicates.clusters:
+        collapsed = sum(len(urls) for urls in crawl.duplicates.clusters.values())
+        print(f"Collapsed {collapsed} near-duplicate pages into {len(crawl.duplicates.clusters)} clusters")
+    if crawl.queues.skipped:
+        reasons = Counter(reason.split(':')[0] for _, reason in crawl.queues.skipped)
+        print(f"Skipped {len(crawl.queues.skipped)} URLs: "
+              + ', '.join(f"{count} {reason}" for reason, count in reasons.most_common()))
+    return crawl.all_links, crawl.content_map
+
+def _crawl_browser(crawl):
+    """Browser-mode crawl: render frontier batches in parallel across the driver pool."""
+    while crawl.queues:
+        crawl.check_cancelled()
+        crawl.save_checkpoint()
+        batch = crawl.queues.next_batch(crawl.driver_pool.size)
+        if not batch:
+            break
+        batch = crawl.take_stored(batch)
+        if not batch:
+            continue
+        crawl.start_batch(batch)
 
-    return all_links, content_map
+        # Add progress logging
+        print(f"\nCrawling {len(batch)} pages at depth {batch[0][1]}/{crawl.frontier.max_depth}")
+        print(f"Total URLs visited so far: {len(crawl.visited)}, queued: {len(crawl.queues)}")
+
+        entries = {url: crawl.cached(url) for url, _ in batch}
+        to_render = [url for url, _ in batch if not crawl.is_fresh(entries[url])]
+        rendered = dict(zip(to_render, crawl.driver_pool.map(
+            lambda driver, url: crawl.render_and_extract(driver, url, entries[url]), to_render)))
+
+        for url, depth in batch:
+            entry = entries[url]
+            extraction = None
+            base_url = None
+            if url in rendered:
+                page_source, base_url, extraction = rendered[url] or (None, None, None)
+                refresh_cache = True
+            else:
+                print(f"Using cached copy of {url}")
+                page_source = entry.html
+                refresh_cache = False
+
+            if not page_source:
+                print(f"Warning: Empty page source received for {url}")
+                continue
+            print(f"Retrieved {len(page_source)} characters of HTML from {url}")
+            crawl.page_fetched(url, page_source, 'browser' if refresh_cache else 'cache')
+            try:
+                crawl.add_page(url, depth, page_source, cached=entry, refresh_cache=refresh_cache,
+                               extraction=extraction, base_url=base_url)
+            except Exception as e:
+                print(f"Error crawling {url}: {e}")
+
+async def _crawl_static(crawl, concurrency):
+    """
+    Static-mode crawl: fetch frontier batches concurrently over a pooled HTTP
+    session and render JS-rendered pages in parallel across the driver pool.
+    Cached pages are served directly while fresh and revalidated with
+    conditional requests once stale.
+    """
+    cache = crawl.page_cache
+    scheduler = crawl.scheduler
+    loop = asyncio.get_running_loop()
+
+    async def polite_fetch(session, url, headers):
+        await scheduler.acquire(url)
+        started = time.monotonic()
+        with span('fetch', url=url):
+            status, html, response_headers, reason, final_url = await fetch_html(
+                session, url, headers, crawl.guard.max_bytes)
+        if status is None or status >= 400:
+            ERRORS.inc(stage='fetch')
+        retry = scheduler.release(url, status, time.monotonic() - started, response_headers.get('Retry-After'))
+        return status, html, response_headers, reason, final_url, retry
+
+    async def fetch_page(session, url, entry):
+        """
+        Fetch one page of a batch and submit it for extraction right away,
+        while the rest of the batch is still downloading.
+
+        Returns:
+            ('page', (html, keyword arguments for add_page)), ('browser', None)
+            for pages to render, ('retry', None), ('skip', None) or
+            ('error', None) for failed requests.
+        """
+        reason = crawl.guard.check_url(url)
+        if reason:
+            crawl.skip(url, reason)
+            return 'skip', None
+        status, html, headers, reason, final_url, retry = await polite_fetch(
+            session, url, cache.conditional_headers(entry) if cache else None)
+        if retry:
+            return 'retry', None
+        if reason:
+            crawl.guard.remember(url, reason)
+            crawl.skip(url, reason)
+            return 'skip', None
+        if status == 304 and entry is not None:
+            print(f"Not modified since last crawl: {url}")
+            CACHE_REQUESTS.inc(cache='page', result='revalidated')
+            cache.mark_revalidated(url)
+            return 'page', (entry.html, {'cached': entry, 'refresh_cache': False})
+        if status in BROWSER_RETRY_STATUSES:
+            print(f"Got {status} for {url}; retrying in the browser")
+            return 'browser', None
+        if status is None or status >= 300:
+            # Broken link or dead host (counted in the fetch errors): a render would fail too
+            print(f"Failed to fetch {url}: {status or 'network error'}")
+            return 'error', None
+        if html is None:
+            # Non-HTML resource; nothing to render or parse
+            return 'skip', None
+        # Known to be an HTML page of acceptable size, should it need rendering
+        crawl.guard.remember(url, None)
+        if looks_js_rendered(html):
+            print(f"Falling back to browser for {url}")
+            return 'browser', None
+        return 'page', (html, {
+            'source': 'network',
+            'cached': entry,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'base_url': final_url,
+            'extraction': await crawl.start_extraction_async(url, html, entry, final_url)
+        })
+
+    async with create_session(concurrency) as session:
+        while crawl.queues:
+            crawl.check_cancelled()
+            crawl.save_checkpoint()
+            # Robots.txt is fetched the first time a host is seen, so keep it off the event loop
+            batch = await loop.run_in_executor(None, crawl.queues.next_batch, concurrency)
+            if not batch:
+                break
+            batch = crawl.take_stored(batch)
+            if not batch:
+                continue
+            crawl.start_batch(batch)
+            print(f"\nCrawling {len(batch)} pages at depth {batch[0][1]}-{batch[-1][1]}/{crawl.frontier.max_depth} "
+                  f"(visited so far: {len(crawl.visited)}, queued: {len(crawl.queues)})")
+
+            entries = {url: crawl.cached(url) for url, _ in batch}
+            # url -> (html, keyword arguments for add_page)
+            pages = {}
+            to_fetch = []
+            for url, depth in batch:
+                entry = entries[url]
+                if crawl.is_fresh(entry):
+                    pages[url] = (entry.html, {'cached': entry, 'refresh_cache': False})
+                else:
+                    to_fetch.append((url, depth))
+
+            results = await asyncio.gather(*(fetch_page(session, url, entries[url]) for url, _ in to_fetch))
+
+            needs_browser = []
+            for (url, depth), (outcome, page) in zip(to_fetch, results):
+                if outcome == 'retry':
+                    crawl.queues.retry(url, depth)
+                elif outcome == 'browser':
+                    needs_browser.append(url)
+                elif outcome == 'page':
+                    pages[url] = page
+
+            if needs_browser:
+                rendered = await loop.run_in_executor(None, crawl.driver_pool.map, lambda driver, url:
+                                                      crawl.render_and_extract(driver, url, entries[url]), needs_browser)
+                for url, result in zip(needs_browser, rendered):
+                    html, base_url, extraction = result or (None, None, None)
+                    pages[url] = (html, {'source': 'browser', 'cached': entries[url], 'extraction': extraction,
+                                         'base_url': base_url})
+
+            # Assemble in frontier order; wait for the workers off the event loop
+            for url, depth in batch:
+                if url not in pages:
+                    continue
+                html, page_kwargs = pages[url]
+                if not html:
+                    print(f"Warning: Empty page source received for {url}")
+                    continue
+                crawl.page_fetched(url, html, page_kwargs.pop('source', 'cache'))
+                if page_kwargs.get('extraction') is not None:
+                    await page_kwargs['extraction'].wait()
+                try:
+                    crawl.add_page(url, depth, html, **page_kwargs)
+                except Exception as e:
+                    print(f"Error crawling {url}: {e}")
 
 if __name__ == "__main__":
     start_url = input("Enter the starting URL: ")
     max_depth = int(input("Enter maximum crawl depth (default 3): ") or "3")
+    max_pages_input = input("Enter maximum number of pages (press Enter for no limit): ")
+    max_pages = int(max_pages_input) if max_pages_input else None
     allowed_domains_input = input("Enter allowed domains (comma-separated, press Enter for same domain only): ")
     
     allowed_domains = None
@@ -122,18 +734,42 @@ if __name__ == "__main__":
     else:
         allowed_domains = [urlparse(start_url).netloc]
     
+    mode = input("Enter rendering mode - static or browser (default browser): ").strip().lower() or "browser"
+
     output_filename = input("Enter the output filename for links (e.g., links.txt): ")
     content_filename = input("Enter the filename for combined content (e.g., all_content.txt): ")
 
+    # Pages are streamed to disk during the crawl and read back for the content file;
+    # together with the checkpoint they let an interrupted crawl continue
+    checkpoint = CrawlCheckpoint(f"{content_filename}.checkpoint.json.gz")
+    if checkpoint.exists():
+        answer = input("Found a checkpoint of an interrupted crawl. Resume it? (Y/n): ").strip().lower()
+        if answer in ('n', 'no'):
+            checkpoint.delete()
+            PageStore(f"{content_filename}.pages.db").delete()
+    page_store = PageStore(f"{content_filename}.pages.db")
+    # Pages are parsed on every core while the crawl keeps fetching
+    extractor = ExtractionPool()
+    extractor.start()
+    finished = False
+    skipped = []
+
     try:
-        # Initialize the WebDriver
-        driver = setup_driver()
+        # Initialize the WebDriver (static mode starts one only if a page needs it)
+        driver = setup_driver() if mode == "browser" else None
         
         scraped_links, content_map = crawl_and_scrape(
             start_url,
             max_depth=max_depth,
             driver=driver,
-            allowed_domains=allowed_domains
+            allowed_domains=allowed_domains,
+            mode=mode,
+            max_pages=max_pages,
+            page_store=page_store,
+            page_cache=PageCache(),
+            checkpoint=checkpoint,
+            extractor=extractor,
+            skipped=skipped
         )
 
         # Write the links to the main output file
@@ -142,46 +778,41 @@ if __name__ == "__main__":
             for link in scraped_links:
                 f.write(f"{link}\n")
             f.write(f"\nTotal unique links found: {len(scraped_links)}")
+            if skipped:
+                f.write(f"\n\nSkipped URLs ({len(skipped)}):\n")
+                for skipped_url, reason in skipped:
+                    f.write(f"{skipped_url}  [{reason}]\n")
 
-        # Process all HTML content and combine into one text file
+        # Combine the extracted text of all pages into one text file
         with open(content_filename, "w", encoding="utf-8") as f:
             f.write(f"Combined content from {len(content_map)} pages\n")
             f.write("=" * 80 + "\n\n")
             
-            for url, html_content in content_map.items():
-                try:
-                    # Parse HTML and extract text
-                    soup = BeautifulSoup(html_content, "html.parser")
-                    
-                    # Remove script and style elements
-                    for script in soup(["script", "style"]):
-                        script.decompose()
-                        
-                    # Get text and clean it up
-                    text = soup.get_text()
-                    # Break into lines and remove leading/trailing space on each
-                    lines = (line.strip() for line in text.splitlines())
-                    # Break multi-headlines into a line each
-                    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                    # Drop blank lines
-                    text = '\n'.join(chunk for chunk in chunks if chunk)
-                    
-                    # Write the URL and content with clear separation
-                    f.write(f"URL: {url}\n")
-                    f.write("-" * 80 + "\n")
-                    f.write(text)
-                    f.write("\n\n")
-                    f.write("=" * 80 + "\n\n")
-                    
-                except Exception as e:
-                    print(f"Error processing content for {url}: {e}")
+            for url, doc in content_map.items():
+                if doc.duplicate_of:
+                    continue
+                # Write the URL and content with clear separation
+                f.write(f"URL: {url}\n")
+                f.write("-" * 80 + "\n")
+                f.write(doc.text)
+                f.write("\n\n")
+                f.write("=" * 80 + "\n\n")
 
+        scraped_links.close()
         print(f"Links written to: {output_filename}")
         print(f"Combined content written to: {content_filename}")
+        finished = True
 
     except Exception as e:
         print(f"A general error occurred: {e}")
     finally:
         # Make sure to close the browser
-        if 'driver' in locals():
-            driver.quit()
\ No newline at end of file
+        if locals().get('driver') is not None:
+            driver.quit()
+        extractor.close()
+        if finished:
+            page_store.delete()
+            checkpoint.delete()
+        else:
+            page_store.close()
+            print("Run the crawler again with the same content filename to resume")
\ No newline at end of file
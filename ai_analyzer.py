@@ -3,6 +3,9 @@ from bs4 import BeautifulSoup
 import os
 from dotenv import load_dotenv
 import re
+from context_selection import select_context, DEFAULT_CONTEXT_TOKENS
+from llm_cache import LLMCache, request_key, DEFAULT_LLM_CACHE_PATH, DEFAULT_TTL as DEFAULT_LLM_CACHE_TTL
+from metrics import span, record_llm_tokens, CACHE_REQUESTS
 
 # Load environment variables
 load_dotenv()
@@ -10,45 +13,78 @@ load_dotenv()
 # Initialize OpenAI client
 client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-def preprocess_content(text):
+# Token budget for website content in the analysis prompt
+MAX_CONTEXT_TOKENS = int(os.getenv('MAX_CONTEXT_TOKENS', str(DEFAULT_CONTEXT_TOKENS)))
+
+ANALYSIS_MODEL = os.getenv('ANALYSIS_MODEL', 'gpt-4')
+# Deterministic mode (the default) samples greedily with a fixed seed so the
+# same prompt gives the same report and cached results stand in for new calls
+if os.getenv('LLM_DETERMINISTIC', 'true').lower() in ('0', 'false', 'no'):
+    ANALYSIS_PARAMS = {'temperature': 0.7, 'max_tokens': 1000}
+else:
+    ANALYSIS_PARAMS = {'temperature': 0, 'seed': int(os.getenv('LLM_SEED', '42')), 'max_tokens': 1000}
+
+# Persistent cache of completions so repeat analyses of unchanged sites skip the API
+llm_cache = None
+if os.getenv('LLM_CACHE_DISABLED', '').lower() not in ('1', 'true', 'yes'):
+    llm_cache = LLMCache(
+        os.getenv('LLM_CACHE_PATH', DEFAULT_LLM_CACHE_PATH),
+        ttl=int(os.getenv('LLM_CACHE_TTL', str(DEFAULT_LLM_CACHE_TTL))),
+        max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+    )
+
+# Common boilerplate text and navigation elements, compiled into a single
+# alternation so the text is scanned once. Used as the fallback when the
+# crawl did not have enough pages to learn the site template.
+BOILERPLATE_PATTERNS = [
+    r'Accept\s+cookies?',
+    r'Privacy Policy',
+    r'Terms of Use',
+    r'Copyright © \d{4}',
+    r'All rights reserved',
+    r'MENU\s*MENU',
+    r'Select Page',
+    r'VER INVESTIMENTOS',
+    r'Mapa do Site',
+    r'Avisos Legais',
+    r'Proteção de Dados',
+    r'RGPD',
+    r'Termos de Uso',
+    r'Política de Cookies'
+]
+BOILERPLATE_RE = re.compile('|'.join(f'(?:{p})' for p in BOILERPLATE_PATTERNS), re.IGNORECASE)
+
+def clean_lines(text, seen=None):
     """
-    Preprocess and clean the content to reduce size and improve relevance.
+    Strip boilerplate and extra whitespace from each line and drop repeated lines.
+
+    Args:
+        text (str): The text to clean
+        seen (set, optional): Lowercased lines already kept, shared across
+            calls to drop lines repeated between pages
+
+    Returns:
+        list: The remaining lines
     """
-    # Remove extra whitespace and newlines
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-    
-    # Remove common boilerplate text and navigation elements
-    patterns_to_remove = [
-        r'Accept\s+cookies?',
-        r'Privacy Policy',
-        r'Terms of Use',
-        r'Copyright © \d{4}',
-        r'All rights reserved',
-        r'MENU\s*MENU',
-        r'Select Page',
-        r'VER INVESTIMENTOS',
-        r'Mapa do Site',
-        r'Avisos Legais',
-        r'Proteção de Dados',
-        r'RGPD',
-        r'Termos de Uso',
-        r'Política de Cookies'
-    ]
-    
-    for pattern in patterns_to_remove:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
-    
-    # Remove duplicate sections (often found in navigation and content)
-    lines = text.split('\n')
+    if seen is None:
+        seen = set()
     unique_lines = []
-    seen = set()
-    for line in lines:
-        line_lower = line.lower().strip()
+    for line in text.splitlines():
+        # Remove common boilerplate text and extra whitespace
+        line = ' '.join(BOILERPLATE_RE.sub('', line).split())
+        line_lower = line.lower()
         if line_lower and line_lower not in seen:
             seen.add(line_lower)
             unique_lines.append(line)
-    text = ' '.join(unique_lines)
+    return unique_lines
+
+def preprocess_content(text):
+    """
+    Preprocess and clean the content to reduce size and improve relevance.
+    """
+    # Remove duplicate lines (often found in navigation and content) before
+    # whitespace is collapsed, while line boundaries still exist
+    text = ' '.join(clean_lines(text))
     
     # Limit to first 4000 characters (approximately 1000 tokens)
     # This ensures we have room for the prompt and response
@@ -111,13 +147,133 @@ def extract_key_sections(content):
     
     return '\n\n'.join(important_sections)
 
-def analyze_website_content(content, about_page_content=None):
+def complete(messages, model=ANALYSIS_MODEL, params=None, use_cache=True, on_token=None):
+    """
+    Run a chat completion, serving repeated requests from the LLM cache.
+    
+    Args:
+        messages (list): Chat messages for the request
+        model (str): The model name
+        params (dict, optional): Sampling parameters, ANALYSIS_PARAMS by default
+        use_cache (bool): Whether to read and write the LLM cache
+        on_token (callable, optional): Called with each piece of text as the
+            response streams in (once with the whole text on a cache hit)
+    
+    Returns:
+        tuple: (completion text, whether it came from the cache)
+    """
+    params = ANALYSIS_PARAMS if params is None else params
+    cache = llm_cache if use_cache else None
+    key = request_key(model, messages, params) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        CACHE_REQUESTS.inc(cache='llm', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            print(f"LLM cache hit ({cache.stats()})")
+            if on_token is not None:
+                on_token(cached)
+            return cached, True
+
+    usage = None
+    with span('llm', model=model):
+        if on_token is None:
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+            text = response.choices[0].message.content
+            usage = response.usage
+        else:
+            parts = []
+            for chunk in client.chat.completions.create(model=model, messages=messages, stream=True, **params):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    on_token(delta)
+            text = ''.join(parts)
+    record_llm_tokens(messages, text, usage)
+    if cache is not None and text:
+        cache.put(key, model, text)
+    return text, False
+
+def analysis_messages(final_content):
+    """
+    Build the chat messages asking for the six-section website report.
+    
+    Args:
+        final_content (str): The website content to analyze
+    
+    Returns:
+        list: Messages for the chat completion
+    """
+    prompt = f"""Analyze the following website content and provide a structured analysis with these specific sections:
+
+1. Company/Website Description (1 paragraph)
+2. Key Offerings and Features
+3. Market Positioning & Differentiators
+4. Target Sectors & Use Cases
+5. Team Members (if available)
+6. Company Location
+
+
+Website Content:
+{final_content}
+
+Please provide a structured analysis with clear section headers. If information for any section is not available, indicate "Information not available" for that section.
+"""
+
+    return [
+        {"role": "system", "content": "You are a business analyst expert at analyzing company websites and providing structured insights."},
+        {"role": "user", "content": prompt}
+    ]
+
+def truncate_sections(content, about_page_content=None):
+    """
+    Build the prompt content by preprocessing and truncating the main and About page content.
+    
+    Args:
+        content (str): The main website content
+        about_page_content (str, optional): Content from the About page if available
+    
+    Returns:
+        str: Content for the analysis prompt
+    """
+    print(f"Processing main content ({len(content)} characters)...")
+    # Preprocess main content
+    processed_content = preprocess_content(content)
+    print(f"Preprocessed content length: {len(processed_content)} characters")
+    
+    key_sections = extract_key_sections(processed_content)
+    print(f"Extracted key sections length: {len(key_sections)} characters")
+    
+    # Preprocess about page content if available
+    if about_page_content:
+        print(f"Processing about page content ({len(about_page_content)} characters)...")
+        processed_about = preprocess_content(about_page_content)
+        about_sections = extract_key_sections(processed_about)
+        # Combine but ensure we don't exceed length limits
+        combined_length = len(key_sections) + len(about_sections)
+        if combined_length > 6000:  # Leave room for prompt and response
+            # Prioritize main content but keep some about content
+            about_sections = about_sections[:2000]
+            key_sections = key_sections[:4000]
+        return f"{key_sections}\n\nABOUT PAGE CONTENT:\n{about_sections}"
+    
+    print("No about page content available")
+    return key_sections[:6000]  # Ensure we don't exceed limits
+
+def analyze_website_content(content, about_page_content=None, pages=None, max_context_tokens=MAX_CONTEXT_TOKENS,
+                            use_cache=True, on_token=None):
     """
     Analyze website content using GPT-4 and generate a structured analysis.
     
     Args:
         content (str): The main website content
         about_page_content (str, optional): Content from the About page if available
+        pages (list, optional): (url, text) pairs for the crawled pages. When
+            given, the prompt holds the chunks of all pages that rank highest
+            for each report section, packed into max_context_tokens, instead
+            of truncated content and about_page_content
+        max_context_tokens (int): Token budget for website content in the prompt
+        use_cache (bool): Reuse a cached analysis of an identical prompt
+        on_token (callable, optional): Receives the analysis text as it streams in
     
     Returns:
         dict: Structured analysis of the website
@@ -131,29 +287,14 @@ def analyze_website_content(content, about_page_content=None):
                 'error': 'No content provided for analysis'
             }
 
-        print(f"Processing main content ({len(content)} characters)...")
-        # Preprocess main content
-        processed_content = preprocess_content(content)
-        print(f"Preprocessed content length: {len(processed_content)} characters")
-        
-        key_sections = extract_key_sections(processed_content)
-        print(f"Extracted key sections length: {len(key_sections)} characters")
-        
-        # Preprocess about page content if available
-        if about_page_content:
-            print(f"Processing about page content ({len(about_page_content)} characters)...")
-            processed_about = preprocess_content(about_page_content)
-            about_sections = extract_key_sections(processed_about)
-            # Combine but ensure we don't exceed length limits
-            combined_length = len(key_sections) + len(about_sections)
-            if combined_length > 6000:  # Leave room for prompt and response
-                # Prioritize main content but keep some about content
-                about_sections = about_sections[:2000]
-                key_sections = key_sections[:4000]
-            final_content = f"{key_sections}\n\nABOUT PAGE CONTENT:\n{about_sections}"
+        if pages:
+            print(f"Selecting relevant content from {len(pages)} pages...")
+            seen = set()
+            cleaned_pages = [(url, '\n'.join(clean_lines(text, seen))) for url, text in pages]
+            with span('select_context'):
+                final_content = select_context(cleaned_pages, max_context_tokens)
         else:
-            print("No about page content available")
-            final_content = key_sections[:6000]  # Ensure we don't exceed limits
+            final_content = truncate_sections(content, about_page_content)
 
         print(f"Final content for analysis: {len(final_content)} characters")
         if not final_content.strip():
@@ -163,40 +304,15 @@ def analyze_website_content(content, about_page_content=None):
                 'error': 'No meaningful content found after processing'
             }
 
-        # Prepare the prompt for GPT-4
-        prompt = f"""Analyze the following website content and provide a structured analysis with these specific sections:
-
-1. Company/Website Description (1 paragraph)
-2. Key Offerings and Features
-3. Market Positioning & Differentiators
-4. Target Sectors & Use Cases
-5. Team Members (if available)
-6. Company Location
-
-
-Website Content:
-{final_content}
-
-Please provide a structured analysis with clear section headers. If information for any section is not available, indicate "Information not available" for that section.
-"""
-
         print("Calling GPT-4 API...")
-        # Call GPT-4 API
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a business analyst expert at analyzing company websites and providing structured insights."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000  # Reduced from 1500 to ensure we stay within limits
-        )
-
-        print("GPT-4 API call successful")
+        analysis, cached = complete(analysis_messages(final_content), use_cache=use_cache, on_token=on_token)
+
+        print("Analysis served from cache" if cached else "GPT-4 API call successful")
         # Return the analysis
         return {
             'success': True,
-            'analysis': response.choices[0].message.content
+            'analysis': analysis,
+            'cached': cached
         }
     except Exception as e:
         print(f"Error in AI analysis: {str(e)}")
@@ -1,13 +1,33 @@
-from flask import Flask, render_template, request, send_file, jsonify
-from bs4 import BeautifulSoup
+from flask import Flask, render_template, request, send_file, jsonify, Response
 from MyCrawler import setup_driver, crawl_and_scrape
+from driver_pool import DriverPool
+from extraction import get_allowed_tags
+from page_store import PageStore
+from page_cache import PageCache, DEFAULT_CACHE_PATH, DEFAULT_TTL
+from politeness import HostScheduler, DEFAULT_RATE, DEFAULT_MAX_IN_FLIGHT
+from task_queue import TaskQueue, QueueFull, TaskCancelled, DEFAULT_WORKERS, DEFAULT_MAX_QUEUED, DEFAULT_TASK_TIMEOUT
+from progress import ProgressHub, format_sse
+from task_store import create_task_store, cleanup_expired_tasks, DEFAULT_TASK_DB_PATH, DEFAULT_TASK_TTL
+from metrics import REGISTRY, TASKS, span, trace_task
+from checkpoint import CrawlCheckpoint, DEFAULT_CHECKPOINT_INTERVAL
+from extraction_pool import ExtractionPool, DEFAULT_EXTRACT_WORKERS
+from content_guard import ContentGuard, DEFAULT_MAX_PAGE_BYTES, DEFAULT_MAX_RENDER_SECONDS
+from result_files import PageRecordWriter, compress_file, negotiate, accepted_encodings, gzip_stream
 import os
+import json
+import mimetypes
 import threading
+from functools import partial
+import atexit
 from werkzeug.utils import secure_filename
 import time
+import uuid
 from urllib.parse import urlparse
 import re
-from ai_analyzer import analyze_website_content, format_analysis_for_download
+from ai_analyzer import format_analysis_for_download
+from site_analysis import collect_pages, run_analysis, ANALYSIS_MODES, DEFAULT_ANALYSIS_MODE
+from batch import (BatchRunner, read_sites, completed_urls, normalize_site_url, DEFAULT_SITE_WORKERS,
+                   DEFAULT_ANALYSIS_WORKERS, DEFAULT_BATCH_DEPTH, DEFAULT_BATCH_MAX_PAGES)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'downloads'
@@ -16,8 +36,101 @@ app.config['UPLOAD_FOLDER'] = 'downloads'
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
-# Store crawling status
-crawl_status = {}
+# Store crawling status in a task store shared by every worker process
+# (TASK_STORE=memory keeps it in a dict for development)
+crawl_status = create_task_store(
+    os.getenv('TASK_STORE', 'sqlite'),
+    os.getenv('TASK_STORE_PATH', DEFAULT_TASK_DB_PATH)
+)
+atexit.register(crawl_status.close)
+
+# Worker processes that parse pages while crawls keep fetching (0 parses inline).
+# Started here, before any thread exists, because the workers are forked
+extraction_pool = ExtractionPool(int(os.getenv('EXTRACT_WORKERS', str(DEFAULT_EXTRACT_WORKERS))))
+extraction_pool.start()
+atexit.register(extraction_pool.close)
+
+# Finished tasks and their files in downloads/ are removed after TASK_TTL seconds
+TASK_TTL = int(os.getenv('TASK_TTL', str(DEFAULT_TASK_TTL)))
+TASK_CLEANUP_INTERVAL = int(os.getenv('TASK_CLEANUP_INTERVAL', '3600'))
+
+def cleanup_loop():
+    while True:
+        try:
+            cleanup_expired_tasks(crawl_status, app.config['UPLOAD_FOLDER'], TASK_TTL)
+        except Exception as e:
+            print(f"Task cleanup failed: {str(e)}")
+        time.sleep(TASK_CLEANUP_INTERVAL)
+
+threading.Thread(target=cleanup_loop, name='task-cleanup', daemon=True).start()
+
+# Pages larger than this or slower to render are skipped; the per-URL
+# content checks are shared by all crawl tasks
+content_guard = ContentGuard(
+    max_bytes=int(float(os.getenv('MAX_PAGE_MB', str(DEFAULT_MAX_PAGE_BYTES // (1024 * 1024)))) * 1024 * 1024),
+    max_render_seconds=float(os.getenv('MAX_RENDER_SECONDS', str(DEFAULT_MAX_RENDER_SECONDS)))
+)
+
+# Warm Chrome instances shared by all crawl tasks; browsers start on first use
+driver_pool = DriverPool(
+    partial(setup_driver, page_load_timeout=content_guard.max_render_seconds),
+    size=int(os.getenv('DRIVER_POOL_SIZE', '2')),
+    max_pages_per_driver=int(os.getenv('DRIVER_MAX_PAGES', '50'))
+)
+atexit.register(driver_pool.close)
+
+# Per-host rate limits and robots.txt rules shared by all crawl tasks
+host_scheduler = HostScheduler(
+    rate=float(os.getenv('CRAWL_RATE_PER_HOST', str(DEFAULT_RATE))),
+    max_in_flight=int(os.getenv('CRAWL_MAX_IN_FLIGHT_PER_HOST', str(DEFAULT_MAX_IN_FLIGHT))),
+    respect_robots=os.getenv('RESPECT_ROBOTS_TXT', 'true').lower() not in ('0', 'false', 'no')
+)
+
+# Persistent page cache so recrawls of unchanged sites skip fetching and parsing
+page_cache = None
+if os.getenv('PAGE_CACHE_DISABLED', '').lower() not in ('1', 'true', 'yes'):
+    page_cache = PageCache(
+        os.getenv('PAGE_CACHE_PATH', DEFAULT_CACHE_PATH),
+        ttl=int(os.getenv('PAGE_CACHE_TTL', str(DEFAULT_TTL))),
+        max_bytes=int(os.getenv('PAGE_CACHE_MAX_MB', '500')) * 1024 * 1024
+    )
+
+# Fixed pool of crawl workers; requests beyond the queue limit get 429
+task_queue = TaskQueue(
+    workers=int(os.getenv('CRAWL_WORKERS', str(DEFAULT_WORKERS))),
+    max_queued=int(os.getenv('CRAWL_QUEUE_SIZE', str(DEFAULT_MAX_QUEUED))),
+    timeout=int(os.getenv('CRAWL_TASK_TIMEOUT', str(DEFAULT_TASK_TIMEOUT)))
+)
+# Live progress events for the /events stream
+progress_hub = ProgressHub()
+# Seconds between status updates on an idle event stream
+SSE_STATUS_INTERVAL = 2.0
+# Progress written to the task store at most this often while crawling
+PROGRESS_UPDATE_INTERVAL = 1.0
+# Share of the progress bar covered by crawling; analysis fills the rest
+CRAWL_PROGRESS_SHARE = 70
+
+# Upper bound on pages per crawl, whatever the request asks for
+MAX_PAGES_PER_TASK = int(os.getenv('MAX_PAGES_PER_TASK', '1000'))
+# Links beyond the crawl depth go to a Bloom filter of this capacity (0 keeps them exact)
+LINK_BLOOM_CAPACITY = int(os.getenv('LINK_BLOOM_CAPACITY', '0'))
+
+# Batch jobs: sites crawled and analyses run at once within one batch, and
+# the time limit for a whole batch
+BATCH_SITE_WORKERS = int(os.getenv('BATCH_SITE_WORKERS', str(DEFAULT_SITE_WORKERS)))
+BATCH_ANALYSIS_WORKERS = int(os.getenv('BATCH_ANALYSIS_WORKERS', str(DEFAULT_ANALYSIS_WORKERS)))
+BATCH_TASK_TIMEOUT = int(os.getenv('BATCH_TASK_TIMEOUT', str(24 * 60 * 60)))
+
+# Seconds between checkpoints of a running crawl, which /crawl can resume from
+CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', str(DEFAULT_CHECKPOINT_INTERVAL)))
+
+# Per-task traces of every timed span are written here as JSON when set
+TRACE_DIR = os.getenv('TRACE_DIR')
+
+REGISTRY.gauge('crawler_task_queue', 'Tasks of this process, by state', ('state',),
+               callback=lambda: {state: task_queue.stats()[state] for state in ('running', 'queued')})
+REGISTRY.gauge('crawler_queue_oldest_wait_seconds', 'Wait of the longest-queued task',
+               callback=lambda: {(): task_queue.stats()['oldest_wait']})
 
 def get_safe_filename(url):
     """Extract domain name from URL and create a safe filename."""
@@ -26,38 +139,87 @@ def get_safe_filename(url):
     base_name = domain.split('.')[0]
     safe_name = re.sub(r'[^a-zA-Z0-9]', '_', base_name)
     timestamp = str(int(time.time()))
-    return safe_name, f"{safe_name}_{timestamp}"
-
-def get_allowed_tags(filters):
-    tags = []
-    if 'p' in filters:
-        tags.extend(['p'])
-    if 'h' in filters:
-        tags.extend(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-    if 'l' in filters:
-        tags.extend(['ul', 'ol', 'li'])
-    return tags if tags else None
-
-def extract_filtered_content(soup, allowed_tags=None):
-    if allowed_tags:
-        # Extract only specified tags
-        elements = []
-        for tag in allowed_tags:
-            elements.extend(soup.find_all(tag))
-        return '\n'.join(elem.get_text().strip() for elem in elements if elem.get_text().strip())
-    else:
-        # Extract all text if no tags specified
-        return soup.get_text()
+    # Requests for the same site can arrive within the same second
+    return safe_name, f"{safe_name}_{timestamp}_{uuid.uuid4().hex[:6]}"
+
+def check_task(task_id, task=None):
+    """Raise TaskCancelled if the task was cancelled here or through another worker process, or timed out."""
+    if task is not None:
+        task.check()
+    if crawl_status.get(task_id, {}).get('cancel_requested'):
+        raise TaskCancelled('Task was cancelled')
+
+def run_traced(task_id, fn, *args, **kwargs):
+    """Run a task function inside the task's trace and count how it ended."""
+    with trace_task(task_id, TRACE_DIR):
+        try:
+            fn(*args, **kwargs)
+        finally:
+            TASKS.inc(status=crawl_status.get(task_id, {}).get('status', 'unknown'))
+
+def checkpoint_path(task_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_checkpoint.json.gz")
+
+def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3, allowed_domains=None, filters=None, mode='browser', max_pages=None,
+                  analysis_mode=DEFAULT_ANALYSIS_MODE, use_sitemap=False, incremental=False, task=None):
+    """
+    Crawl a site, analyze it and save the reports.
+
+    Progress is checkpointed, so running it again with the same task id
+    after a crash continues where it stopped: completed pages are not
+    fetched again and a finished analysis is not redone.
+    """
+    if crawl_status.get(task_id, {}).get('status') == 'cancelled':
+        # Cancelled through another worker process while it was queued here
+        return
+    last_update = [0.0]
+    # Kept on failure so the task can be resumed
+    keep_files = False
+    # One JSON line per page, written as pages complete and downloadable during the crawl
+    pages_filename = f"{task_id}_pages.ndjson"
+
+    def on_event(event, **data):
+        progress_hub.publish(task_id, event, **data)
+        if event == 'page_parsed' and time.monotonic() - last_update[0] >= PROGRESS_UPDATE_INTERVAL:
+            last_update[0] = time.monotonic()
+            # Breadth-first: the share of known pages already done is a fair estimate
+            done = data['pages'] / max(data['pages'] + data['queued'], 1)
+            crawl_status.update(task_id, progress=int(CRAWL_PROGRESS_SHARE * done),
+                                message=f"Crawled {data['pages']} pages, {data['queued']} queued...")
+
+    def set_stage(stage, message, progress=None):
+        progress_hub.publish(task_id, 'stage', stage=stage, message=message)
+        fields = {'message': message}
+        if progress is not None:
+            fields['progress'] = progress
+        crawl_status.update(task_id, **fields)
 
-def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3, allowed_domains=None, filters=None):
     try:
         crawl_status[task_id] = {
             'status': 'running',
             'progress': 0,
-            'message': 'Initializing crawler...'
+            'message': 'Initializing crawler...',
+            'partial_file': pages_filename
         }
+        progress_hub.publish(task_id, 'stage', stage='started', message='Initializing crawler...')
+
+        checkpoint = CrawlCheckpoint(checkpoint_path(task_id), interval=CHECKPOINT_INTERVAL)
+        if checkpoint.exists():
+            print(f"Resuming task {task_id} from its checkpoint (stage: {checkpoint.stage})")
+        else:
+            checkpoint.save(stage='crawling', params={
+                'url': url, 'max_depth': max_depth, 'allowed_domains': allowed_domains, 'filters': filters,
+                'mode': mode, 'max_pages': max_pages, 'analysis_mode': analysis_mode,
+                'use_sitemap': use_sitemap, 'incremental': incremental
+            })
         
-        driver = setup_driver()
+        # Pages stream to disk as they are crawled instead of accumulating in memory
+        page_store = PageStore(os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_pages.db"))
+        pages_writer = PageRecordWriter(os.path.join(app.config['UPLOAD_FOLDER'], pages_filename))
+        scraped_links = None
+        # A resumed crawl starts with the pages stored before the interruption
+        for _, doc in page_store.items():
+            pages_writer.add(doc)
         
         try:
             print(f"Starting crawl for URL: {url}")
@@ -67,80 +229,78 @@ def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3,
             else:
                 allowed_domains = [urlparse(url).netloc]
             
-            crawl_status[task_id]['message'] = 'Starting crawl...'
+            set_stage('crawling', 'Starting crawl...')
             
+            allowed_tags = get_allowed_tags(filters.split(',')) if filters else None
+            # (url, reason) for every URL the crawl leaves out
+            skipped = []
+
             scraped_links, content_map = crawl_and_scrape(
                 url, 
                 max_depth=int(max_depth),
                 current_depth=0,
                 visited=None,
-                driver=driver,
-                allowed_domains=allowed_domains
+                driver_pool=driver_pool,
+                allowed_domains=allowed_domains,
+                mode=mode,
+                max_pages=min(int(max_pages), MAX_PAGES_PER_TASK) if max_pages else MAX_PAGES_PER_TASK,
+                allowed_tags=allowed_tags,
+                page_store=page_store,
+                page_cache=page_cache,
+                scheduler=host_scheduler,
+                cancel_check=lambda: check_task(task_id, task),
+                on_event=on_event,
+                use_sitemap=use_sitemap,
+                incremental=incremental,
+                checkpoint=checkpoint,
+                bloom_capacity=LINK_BLOOM_CAPACITY or None,
+                extractor=extraction_pool,
+                content_guard=content_guard,
+                skipped=skipped,
+                on_page=pages_writer.add
             )
+            pages_writer.close()
             
-            print(f"Crawl completed. Found {len(scraped_links)} links and {len(content_map)} pages")
+            print(f"Crawl completed. Found {len(scraped_links)} links and {len(content_map)} pages, "
+                  f"skipped {len(skipped)} URLs")
+            if page_cache is not None:
+                print(f"Page cache: {page_cache.stats()}")
             
             # Save links
             output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            with open(output_path, "w", encoding="utf-8") as f:
+            with span('file_write', file='links'), open(output_path, "w", encoding="utf-8") as f:
                 f.write("\nScraped Links:\n")
                 for link in scraped_links:
                     f.write(f"{link}\n")
                 f.write(f"\nTotal unique links found: {len(scraped_links)}")
+                if skipped:
+                    f.write(f"\n\nSkipped URLs ({len(skipped)}):\n")
+                    for skipped_url, reason in skipped:
+                        f.write(f"{skipped_url}  [{reason}]\n")
             
             print(f"Links saved to {output_path}")
-            crawl_status[task_id]['message'] = 'Processing content and generating analysis...'
+            set_stage('processing', 'Processing content and generating analysis...', CRAWL_PROGRESS_SHARE)
 
             # Process content and generate AI analysis
-            main_content = []
-            about_page_content = None
-            
-            print(f"Processing {len(content_map)} pages for analysis...")
-            
-            for page_url, html_content in content_map.items():
-                print(f"Processing page: {page_url}")
-                soup = BeautifulSoup(html_content, "html.parser")
-                
-                # Remove unwanted elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                
-                # Get text content based on filters
-                if filters:
-                    allowed_tags = get_allowed_tags(filters.split(','))
-                    text = extract_filtered_content(soup, allowed_tags)
-                else:
-                    text = soup.get_text()
-                
-                # Clean up the text
-                lines = (line.strip() for line in text.splitlines())
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                
-                if text.strip():  # Only add non-empty content
-                    print(f"Found {len(text)} characters of content")
-                    # Check if this is an about page
-                    if 'about' in page_url.lower():
-                        print("Found about page content")
-                        about_page_content = text
-                    else:
-                        main_content.append(text)
-                else:
-                    print("No content found in page")
+            with span('collect_pages'):
+                pages, duplicate_clusters = collect_pages(content_map)
 
-            # Combine all main content
-            combined_content = '\n\n'.join(main_content)
-            print(f"Total content length: {len(combined_content)} characters")
-            print(f"About page content length: {len(about_page_content) if about_page_content else 0} characters")
+            check_task(task_id, task)
 
-            if not combined_content.strip():
+            if not pages:
                 print("Warning: No content found to analyze!")
                 analysis_text = "Error: No content was found to analyze. The crawler may have been blocked or the page may be empty."
                 analysis_filename = None
+            elif checkpoint.reached('analyzed'):
+                print("Analysis restored from the checkpoint")
+                analysis_text = checkpoint.data['analysis']
+                analysis_filename = checkpoint.data['analysis_file']
             else:
                 # Generate AI analysis
                 print("Sending content to AI analyzer...")
-                analysis_result = analyze_website_content(combined_content, about_page_content)
+                set_stage('analysis', 'Generating AI analysis...', CRAWL_PROGRESS_SHARE + 10)
+                on_token = lambda text: progress_hub.publish(task_id, 'analysis_token', text=text)
+                analysis_result = run_analysis(pages, analysis_mode, on_token=on_token)
                 
                 if analysis_result['success']:
                     analysis_text = analysis_result['analysis']
@@ -149,8 +309,9 @@ def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3,
                     # Save analysis to file
                     analysis_filename = f"{task_id}_analysis.txt"
                     analysis_path = os.path.join(app.config['UPLOAD_FOLDER'], analysis_filename)
-                    with open(analysis_path, "w", encoding="utf-8") as f:
+                    with span('file_write', file='analysis'), open(analysis_path, "w", encoding="utf-8") as f:
                         f.write(format_analysis_for_download(analysis_text))
+                    checkpoint.save(stage='analyzed', analysis=analysis_text, analysis_file=analysis_filename)
                 else:
                     error_msg = analysis_result.get('error', 'Unknown error')
                     print(f"AI analysis failed: {error_msg}")
@@ -159,35 +320,34 @@ def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3,
 
             # Save content
             content_path = os.path.join(app.config['UPLOAD_FOLDER'], content_filename)
-            with open(content_path, "w", encoding="utf-8") as f:
-                f.write(f"Combined content from {len(content_map)} pages\n")
+            collapsed_count = sum(len(urls) for urls in duplicate_clusters.values())
+            with span('file_write', file='content'), open(content_path, "w", encoding="utf-8") as f:
+                f.write(f"Combined content from {len(content_map) - collapsed_count} pages\n")
                 f.write("=" * 80 + "\n\n")
                 
-                for page_url, html_content in content_map.items():
-                    try:
-                        soup = BeautifulSoup(html_content, "html.parser")
-                        for script in soup(["script", "style"]):
-                            script.decompose()
-                        
-                        if filters:
-                            allowed_tags = get_allowed_tags(filters.split(','))
-                            text = extract_filtered_content(soup, allowed_tags)
-                        else:
-                            text = soup.get_text()
-                            
-                        # Clean up the text
-                        lines = (line.strip() for line in text.splitlines())
-                        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                        text = '\n'.join(chunk for chunk in chunks if chunk)
-                        
-                        f.write(f"URL: {page_url}\n")
-                        f.write("-" * 80 + "\n")
-                        f.write(text)
-                        f.write("\n\n")
-                        f.write("=" * 80 + "\n\n")
-                    except Exception as e:
-                        print(f"Error processing content for {page_url}: {str(e)}")
+                for page_url, doc in content_map.items():
+                    if doc.duplicate_of:
+                        continue
+                    f.write(f"URL: {page_url}\n")
+                    f.write("-" * 80 + "\n")
+                    f.write(doc.content_text)
+                    f.write("\n\n")
+                    f.write("=" * 80 + "\n\n")
+
+                if duplicate_clusters:
+                    f.write(f"Near-duplicate pages collapsed: {collapsed_count}\n")
+                    f.write("-" * 80 + "\n")
+                    for original_url, duplicate_urls in duplicate_clusters.items():
+                        f.write(f"{original_url}\n")
+                        for duplicate_url in duplicate_urls:
+                            f.write(f"    duplicate: {duplicate_url}\n")
             
+            # Gzip (and zstd) copies are served to clients that accept them
+            with span('compress'):
+                for filename in (output_filename, content_filename, analysis_filename, pages_filename):
+                    if filename:
+                        compress_file(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+
             # Update status with completion and analysis
             crawl_status[task_id] = {
                 'status': 'completed',
@@ -195,25 +355,45 @@ def perform_crawl(url, output_filename, content_filename, task_id, max_depth=3,
                 'links_file': output_filename,
                 'content_file': content_filename,
                 'analysis_file': analysis_filename,
-                'analysis': analysis_text
+                'pages_file': pages_filename,
+                'analysis': analysis_text,
+                'skipped': len(skipped)
             }
             
+        except TaskCancelled as e:
+            print(f"Crawl {task_id} stopped: {str(e)}")
+            crawl_status[task_id] = {'status': 'cancelled', 'error': str(e)}
         except Exception as e:
             print(f"Error during crawl: {str(e)}")
-            crawl_status[task_id] = {'status': 'error', 'error': str(e)}
+            crawl_status[task_id] = {'status': 'error', 'error': str(e), 'resumable': True}
+            keep_files = True
         finally:
-            driver.quit()
+            pages_writer.close()
+            if scraped_links is not None:
+                scraped_links.close()
+            if keep_files:
+                page_store.close()
+            else:
+                page_store.delete()
+                checkpoint.delete()
             
     except Exception as e:
         print(f"Error in perform_crawl: {str(e)}")
         crawl_status[task_id] = {'status': 'error', 'error': str(e)}
+    finally:
+        progress_hub.publish(task_id, 'status', **crawl_status.get(task_id, {}))
+        progress_hub.finish(task_id)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', max_pages_per_task=MAX_PAGES_PER_TASK)
 
 @app.route('/crawl', methods=['POST'])
 def start_crawl():
+    resume_id = request.form.get('resume', '').strip()
+    if resume_id:
+        return resume_crawl(secure_filename(resume_id))
+
     url = request.form.get('url')
     if not url:
         return jsonify({'error': 'URL is required'}), 400
@@ -221,39 +401,326 @@ def start_crawl():
     max_depth = request.form.get('maxDepth', '3')
     allowed_domains = request.form.get('allowedDomains', '')
     filters = request.form.get('filters', '')
+    max_pages = request.form.get('maxPages', '').strip()
+    if max_pages and (not max_pages.isdigit() or int(max_pages) == 0):
+        return jsonify({'error': 'Maximum pages must be a positive number'}), 400
+    mode = request.form.get('mode', 'browser')
+    if mode not in ('browser', 'static'):
+        return jsonify({'error': 'Invalid rendering mode'}), 400
+    analysis_mode = request.form.get('analysisMode', DEFAULT_ANALYSIS_MODE)
+    if analysis_mode not in ANALYSIS_MODES:
+        return jsonify({'error': 'Invalid analysis mode'}), 400
+    use_sitemap = request.form.get('useSitemap') == '1'
+    incremental = use_sitemap and request.form.get('incremental') == '1'
 
     base_name, unique_id = get_safe_filename(url)
-    output_filename = f"{base_name}_links.txt"
-    content_filename = f"{base_name}_content.txt"
-
-    thread = threading.Thread(
-        target=perform_crawl,
-        args=(url, output_filename, content_filename, unique_id),
-        kwargs={
-            'max_depth': max_depth,
-            'allowed_domains': allowed_domains,
-            'filters': filters
-        }
-    )
-    thread.start()
+    # Output files carry the task id so expired tasks can take their files with them
+    output_filename = f"{unique_id}_links.txt"
+    content_filename = f"{unique_id}_content.txt"
+
+    crawl_status[unique_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker...'
+    }
+    try:
+        task_queue.submit(
+            unique_id, run_traced, unique_id, perform_crawl, url, output_filename, content_filename, unique_id,
+            max_depth=max_depth,
+            allowed_domains=allowed_domains,
+            filters=filters,
+            mode=mode,
+            max_pages=max_pages,
+            analysis_mode=analysis_mode,
+            use_sitemap=use_sitemap,
+            incremental=incremental
+        )
+    except QueueFull:
+        crawl_status.pop(unique_id, None)
+        response = jsonify({'error': 'Too many crawls are waiting; please try again shortly'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
 
     return jsonify({
         'task_id': unique_id,
-        'message': 'Crawling started'
+        'message': 'Crawling queued',
+        'queue_position': task_queue.position(unique_id)
+    })
+
+def resume_crawl(task_id):
+    """Queue an interrupted crawl again; it continues from its last checkpoint."""
+    checkpoint = CrawlCheckpoint(checkpoint_path(task_id))
+    if not checkpoint.exists():
+        return jsonify({'error': 'No checkpoint to resume for this task'}), 404
+    if task_queue.get(task_id) is not None:
+        return jsonify({'error': 'Task is still running'}), 409
+
+    params = dict(checkpoint.data['params'])
+    url = params.pop('url')
+    crawl_status[task_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker to resume...'
+    }
+    try:
+        task_queue.submit(
+            task_id, run_traced, task_id, perform_crawl, url, f"{task_id}_links.txt", f"{task_id}_content.txt",
+            task_id, **params
+        )
+    except QueueFull:
+        crawl_status[task_id] = {'status': 'error', 'error': 'Too many crawls are waiting', 'resumable': True}
+        response = jsonify({'error': 'Too many crawls are waiting; please try again shortly'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    return jsonify({
+        'task_id': task_id,
+        'message': f"Crawl resumed from stage '{checkpoint.stage}'",
+        'queue_position': task_queue.position(task_id)
+    })
+
+def perform_batch(batch_id, input_filename, results_filename, max_depth, max_pages, mode, analysis_mode, task=None):
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+    results_path = os.path.join(app.config['UPLOAD_FOLDER'], results_filename)
+
+    def on_record(record, summary):
+        processed = summary['skipped'] + summary['ok'] + summary['failed']
+        crawl_status.update(
+            batch_id,
+            progress=int(100 * processed / max(summary['total'], 1)),
+            message=f"Processed {processed} of {summary['total']} sites",
+            sites_done=processed,
+            sites_failed=summary['failed']
+        )
+        progress_hub.publish(batch_id, 'site_done', url=record['url'], status=record['status'], **summary)
+
+    try:
+        sites = read_sites(input_path)
+        crawl_status[batch_id] = {
+            'status': 'running',
+            'progress': 0,
+            'message': f"Processing {len(sites)} sites...",
+            'sites_total': len(sites),
+            'results_file': results_filename
+        }
+        runner = BatchRunner(
+            results_path,
+            site_workers=BATCH_SITE_WORKERS,
+            analysis_workers=BATCH_ANALYSIS_WORKERS,
+            max_depth=max_depth,
+            max_pages=max_pages,
+            mode=mode,
+            analysis_mode=analysis_mode,
+            driver_pool=driver_pool,
+            scheduler=host_scheduler,
+            page_cache=page_cache,
+            extractor=extraction_pool,
+            content_guard=content_guard,
+            cancel_check=lambda: check_task(batch_id, task),
+            on_record=on_record
+        )
+        summary = runner.run(sites)
+        compress_file(results_path)
+        crawl_status[batch_id] = {
+            'status': 'completed',
+            'progress': 100,
+            'message': f"{summary['ok'] + summary['skipped']} sites analyzed, {summary['failed']} failed",
+            'sites_total': summary['total'],
+            'sites_done': summary['total'],
+            'sites_failed': summary['failed'],
+            'results_file': results_filename
+        }
+    except TaskCancelled as e:
+        print(f"Batch {batch_id} stopped: {str(e)}")
+        crawl_status.update(batch_id, status='cancelled', error=str(e))
+    except Exception as e:
+        print(f"Error in perform_batch: {str(e)}")
+        crawl_status.update(batch_id, status='error', error=str(e))
+    finally:
+        progress_hub.publish(batch_id, 'status', **crawl_status.get(batch_id, {}))
+        progress_hub.finish(batch_id)
+
+@app.route('/batch', methods=['POST'])
+def start_batch():
+    """
+    Start a batch job over many sites.
+
+    The sites come from an uploaded CSV or JSONL file ('file'), or from a
+    'urls' field with one URL per line. Passing 'resume' with the id of an
+    earlier batch continues it, skipping the sites already in its results.
+    """
+    max_depth = request.form.get('maxDepth', str(DEFAULT_BATCH_DEPTH))
+    max_pages = request.form.get('maxPages', str(DEFAULT_BATCH_MAX_PAGES))
+    if not max_depth.isdigit() or not max_pages.isdigit() or int(max_pages) == 0:
+        return jsonify({'error': 'Maximum depth and pages must be positive numbers'}), 400
+    mode = request.form.get('mode', 'static')
+    if mode not in ('browser', 'static'):
+        return jsonify({'error': 'Invalid rendering mode'}), 400
+    analysis_mode = request.form.get('analysisMode', DEFAULT_ANALYSIS_MODE)
+    if analysis_mode not in ANALYSIS_MODES:
+        return jsonify({'error': 'Invalid analysis mode'}), 400
+
+    resume_id = request.form.get('resume', '').strip()
+    if resume_id:
+        batch_id = secure_filename(resume_id)
+        input_filename = f"{batch_id}_input.jsonl"
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], input_filename)):
+            return jsonify({'error': 'Unknown batch'}), 404
+        if crawl_status.get(batch_id, {}).get('status') in ('queued', 'running'):
+            return jsonify({'error': 'Batch is still running'}), 409
+    else:
+        batch_id = f"batch_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        input_filename = f"{batch_id}_input.jsonl"
+        upload = request.files.get('file')
+        if upload is not None and upload.filename:
+            # Keep the upload's extension so read_sites knows how to parse it
+            upload_path = os.path.join(app.config['UPLOAD_FOLDER'],
+                                       f"{batch_id}_upload{os.path.splitext(secure_filename(upload.filename))[1]}")
+            upload.save(upload_path)
+            try:
+                sites = read_sites(upload_path)
+            except (ValueError, UnicodeDecodeError) as e:
+                return jsonify({'error': f'Could not read the file: {e}'}), 400
+            finally:
+                os.remove(upload_path)
+        else:
+            sites = [{'url': normalize_site_url(line)} for line in request.form.get('urls', '').splitlines()
+                     if line.strip()]
+        if not sites:
+            return jsonify({'error': 'No URLs given'}), 400
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], input_filename), 'w', encoding='utf-8') as f:
+            for site in sites:
+                f.write(json.dumps(site) + '\n')
+
+    results_filename = f"{batch_id}_results.jsonl"
+    crawl_status[batch_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker...',
+        'results_file': results_filename
+    }
+    try:
+        task_queue.submit(
+            batch_id, run_traced, batch_id, perform_batch, batch_id, input_filename, results_filename,
+            int(max_depth), min(int(max_pages), MAX_PAGES_PER_TASK), mode, analysis_mode,
+            timeout=BATCH_TASK_TIMEOUT
+        )
+    except QueueFull:
+        crawl_status.pop(batch_id, None)
+        response = jsonify({'error': 'Too many tasks are waiting; please try again shortly'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    done = completed_urls(os.path.join(app.config['UPLOAD_FOLDER'], results_filename))
+    return jsonify({
+        'task_id': batch_id,
+        'message': 'Batch queued',
+        'sites_already_done': len(done),
+        'results_file': results_filename
     })
 
 @app.route('/status/<task_id>')
 def get_status(task_id):
-    status = crawl_status.get(task_id, {'status': 'not_found'})
-    return jsonify(status)
+    return jsonify(task_status(task_id))
+
+def task_status(task_id):
+    """A task's stored state plus its place in this process's queue."""
+    status = dict(crawl_status.get(task_id, {'status': 'not_found'}))
+    task = task_queue.get(task_id)
+    if task is not None:
+        status['queue_position'] = task_queue.position(task_id)
+        status['queue_depth'] = task_queue.stats()['queued']
+        status['wait_time'] = round(task.wait_time(), 1)
+    return status
+
+@app.route('/events/<task_id>')
+def stream_events(task_id):
+    """
+    Server-Sent Events stream of a task's progress: stage changes, crawl
+    batches and pages, analysis tokens, and 'status' events carrying the
+    same data as /status. The stream ends after the final status.
+    """
+    last_event_id = request.headers.get('Last-Event-ID', '0')
+    last_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    def stream():
+        nonlocal last_id
+        last_status = None
+        while True:
+            events, finished = progress_hub.events_since(task_id, last_id, timeout=SSE_STATUS_INTERVAL)
+            for event_id, event, data in events:
+                last_id = event_id
+                yield format_sse(event_id, event, data)
+            if finished:
+                return
+            # Tasks run by another worker process only report through the task store
+            status = task_status(task_id)
+            if status != last_status:
+                last_status = status
+                yield format_sse(None, 'status', status)
+            elif not events:
+                yield ': keep-alive\n\n'
+            if status['status'] in ('completed', 'error', 'cancelled', 'not_found') \
+                    and not progress_hub.has_task(task_id):
+                return
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_crawl(task_id):
+    # The task may belong to this process's queue or to another worker process;
+    # the shared task store reaches it either way
+    task_queue.cancel(task_id)
+    status = crawl_status.get(task_id, {}).get('status')
+    if status == 'queued':
+        crawl_status[task_id] = {'status': 'cancelled', 'error': 'Task was cancelled'}
+    elif status == 'running':
+        crawl_status.update(task_id, cancel_requested=True)
+    else:
+        return jsonify({'error': 'No running or queued task with this id'}), 404
+    return jsonify({'task_id': task_id, 'message': 'Cancellation requested'})
+
+@app.route('/metrics')
+def metrics():
+    """Counters, gauges and stage latency histograms in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/download/<filename>')
 def download_file(filename):
+    """
+    Serve a result file, gzip- or zstd-compressed when the client accepts
+    it, with ETag revalidation and byte ranges. A running crawl's pages
+    file can be fetched again with a Range from the last size to get only
+    the new lines.
+    """
+    filename = secure_filename(filename)
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    if filename.endswith('.ndjson'):
+        mimetype = 'application/x-ndjson'
+    else:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
     try:
-        return send_file(
-            os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename)),
-            as_attachment=True
-        )
+        if 'Range' in request.headers:
+            # Byte offsets count bytes of the file itself, so ranges are never compressed
+            send_path, encoding = path, None
+        else:
+            send_path, encoding = negotiate(path, request.headers.get('Accept-Encoding'))
+        if encoding is None and 'Range' not in request.headers \
+                and 'gzip' in accepted_encodings(request.headers.get('Accept-Encoding')):
+            # No precompressed copy yet (the crawl is still writing it): compress on the fly
+            response = Response(gzip_stream(path), mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        else:
+            response = send_file(send_path, as_attachment=True, download_name=filename, mimetype=mimetype,
+                                 conditional=True, max_age=0)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
@@ -0,0 +1,323 @@
+import argparse
+import contextvars
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from urllib.parse import urlparse
+
+from MyCrawler import setup_driver, crawl_and_scrape
+from driver_pool import DriverPool
+from extraction_pool import ExtractionPool, DEFAULT_EXTRACT_WORKERS
+from content_guard import ContentGuard, DEFAULT_MAX_PAGE_BYTES, DEFAULT_MAX_RENDER_SECONDS
+from page_store import PageStore
+from page_cache import PageCache
+from politeness import HostScheduler
+from site_analysis import collect_pages, run_analysis, ANALYSIS_MODES, DEFAULT_ANALYSIS_MODE
+from task_queue import TaskCancelled
+
+# Sites crawled at the same time
+DEFAULT_SITE_WORKERS = 4
+# LLM analyses running at the same time across the whole batch
+DEFAULT_ANALYSIS_WORKERS = 2
+DEFAULT_BATCH_DEPTH = 2
+DEFAULT_BATCH_MAX_PAGES = 50
+
+
+def normalize_site_url(url):
+    """Strip a site URL and default to https:// when no scheme is given."""
+    url = url.strip()
+    if url and not urlparse(url).scheme:
+        url = f"https://{url}"
+    return url
+
+
+def read_sites(path):
+    """
+    Read the sites of a batch from a CSV or JSONL file.
+
+    CSV files use their 'url' (or 'website' / 'domain') column, or the
+    first column when there is no such header. JSONL lines are either a
+    URL string or an object with a 'url' key and optional 'max_depth',
+    'max_pages' and 'mode' overrides.
+
+    Returns:
+        A list of site dicts, each with at least a 'url'.
+    """
+    sites = []
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith(('.jsonl', '.json', '.ndjson')):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                sites.append(dict(item) if isinstance(item, dict) else {'url': item})
+        else:
+            rows = list(csv.reader(f))
+            if not rows:
+                return []
+            header = [column.strip().lower() for column in rows[0]]
+            url_column = next((header.index(name) for name in ('url', 'website', 'domain') if name in header), None)
+            if url_column is None:
+                url_column, data = 0, rows
+            else:
+                data = rows[1:]
+            sites = [{'url': row[url_column]} for row in data if len(row) > url_column and row[url_column].strip()]
+
+    for site in sites:
+        site['url'] = normalize_site_url(site['url'])
+    return [site for site in sites if site['url']]
+
+
+def completed_urls(output_path):
+    """URLs that already have a successful record in a batch output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['url'])
+    return done
+
+
+def compact_records(output_path):
+    """
+    Rewrite a batch output file with one record per URL, the last one
+    written winning: a retried site keeps the outcome of its latest
+    attempt, at the position of its first. Lines cut short by an
+    interrupted run are dropped.
+    """
+    if not os.path.exists(output_path):
+        return
+    records = {}
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['url']] = line if line.endswith('\n') else line + '\n'
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(records.values())
+    os.replace(tmp_path, output_path)
+
+
+class BatchRunner:
+    """
+    Crawls and analyzes many sites with shared pools.
+
+    Sites run on `site_workers` threads that share one driver pool, one
+    per-host scheduler, one page cache, one extraction pool and one
+    content guard; LLM analyses are limited to
+    `analysis_workers` at a time across the batch. Each site's record is
+    appended to the JSONL output as soon as it is done, so an interrupted
+    batch resumes by skipping the sites already recorded. Failed sites are
+    retried on resume, and at the end of each run the file is compacted to
+    the latest record per site.
+    """
+
+    def __init__(self, output_path, site_workers=DEFAULT_SITE_WORKERS, analysis_workers=DEFAULT_ANALYSIS_WORKERS,
+                 max_depth=DEFAULT_BATCH_DEPTH, max_pages=DEFAULT_BATCH_MAX_PAGES, mode='static',
+                 analysis_mode=DEFAULT_ANALYSIS_MODE, driver_pool=None, scheduler=None, page_cache=None,
+                 work_dir=None, cancel_check=None, on_record=None, use_sitemap=False, incremental=False,
+                 extractor=None, content_guard=None):
+        self.output_path = output_path
+        self.site_workers = site_workers
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.mode = mode
+        self.analysis_mode = analysis_mode
+        self.use_sitemap = use_sitemap
+        self.incremental = incremental
+        self.content_guard = content_guard if content_guard is not None else ContentGuard()
+        self.owns_pool = driver_pool is None
+        if driver_pool is None:
+            driver_pool = DriverPool(partial(setup_driver, page_load_timeout=self.content_guard.max_render_seconds),
+                                     size=min(site_workers, 2))
+        self.driver_pool = driver_pool
+        self.scheduler = scheduler if scheduler is not None else HostScheduler()
+        self.page_cache = page_cache
+        self.extractor = extractor
+        self.work_dir = work_dir or os.path.dirname(os.path.abspath(output_path))
+        self.cancel_check = cancel_check
+        self.on_record = on_record
+        self._analysis_slots = threading.Semaphore(analysis_workers)
+        self._write_lock = threading.Lock()
+
+    def check_cancelled(self):
+        if self.cancel_check is not None:
+            self.cancel_check()
+
+    def analyze_site(self, index, site):
+        """Crawl and analyze one site. Returns its output record."""
+        self.check_cancelled()
+        url = site['url']
+        record = {'url': url, 'status': 'ok'}
+        prefix = os.path.splitext(os.path.basename(self.output_path))[0]
+        page_store = PageStore(os.path.join(self.work_dir, f"{prefix}_{index}.pages.db"))
+        skipped = []
+        try:
+            started = time.time()
+            links, content_map = crawl_and_scrape(
+                url,
+                max_depth=int(site.get('max_depth', self.max_depth)),
+                allowed_domains=[urlparse(url).netloc],
+                mode=site.get('mode', self.mode),
+                max_pages=int(site.get('max_pages', self.max_pages)),
+                driver_pool=self.driver_pool,
+                page_store=page_store,
+                page_cache=self.page_cache,
+                scheduler=self.scheduler,
+                cancel_check=self.cancel_check,
+                use_sitemap=self.use_sitemap,
+                incremental=self.incremental,
+                extractor=self.extractor,
+                content_guard=self.content_guard,
+                skipped=skipped
+            )
+            record['crawl_seconds'] = round(time.time() - started, 2)
+
+            with links:
+                record['links'] = sorted(links)
+            pages, duplicate_clusters = collect_pages(content_map)
+            record['skipped'] = [[skipped_url, reason] for skipped_url, reason in skipped]
+            record['stats'] = {
+                'pages': len(content_map),
+                'duplicates': sum(len(urls) for urls in duplicate_clusters.values()),
+                'links': len(links),
+                'skipped': len(skipped),
+                'content_chars': sum(len(text) for _, text in pages),
+            }
+
+            self.check_cancelled()
+            if not pages:
+                record.update(status='error', error='No content was found to analyze')
+                return record
+
+            started = time.time()
+            with self._analysis_slots:
+                result = run_analysis(pages, self.analysis_mode)
+            record['analysis_seconds'] = round(time.time() - started, 2)
+            if result['success']:
+                record['analysis'] = result['analysis']
+                record['cached'] = result.get('cached', False)
+            else:
+                record.update(status='error', error=result.get('error', 'Unknown error'))
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            print(f"Error processing {url}: {e}")
+            record.update(status='error', error=str(e))
+        finally:
+            page_store.delete()
+        return record
+
+    def write_record(self, record):
+        record['finished_at'] = time.time()
+        with self._write_lock:
+            with open(self.output_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, sites, resume=True):
+        """
+        Process every site not yet recorded in the output file.
+
+        Returns:
+            dict: Counts of sites total, skipped (already done), ok and failed.
+        """
+        done = completed_urls(self.output_path) if resume else set()
+        if not resume and os.path.exists(self.output_path):
+            os.remove(self.output_path)
+        pending = [(index, site) for index, site in enumerate(sites) if site['url'] not in done]
+        summary = {'total': len(sites), 'skipped': len(sites) - len(pending), 'ok': 0, 'failed': 0}
+        print(f"Batch of {len(sites)} sites: {summary['skipped']} already done, {len(pending)} to process")
+
+        executor = ThreadPoolExecutor(max_workers=self.site_workers)
+        try:
+            # Each site runs in a copy of the caller's context so its spans reach the batch's trace
+            futures = [executor.submit(contextvars.copy_context().run, self.analyze_site, index, site)
+                       for index, site in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                self.write_record(record)
+                summary['ok' if record['status'] == 'ok' else 'failed'] += 1
+                print(f"[{summary['ok'] + summary['failed']}/{len(pending)}] {record['url']}: {record['status']}")
+                if self.on_record is not None:
+                    self.on_record(record, summary)
+        finally:
+            # On cancellation, drop the sites that have not started
+            executor.shutdown(wait=True, cancel_futures=True)
+            if self.owns_pool:
+                self.driver_pool.close()
+            with self._write_lock:
+                compact_records(self.output_path)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl and analyze a list of websites.")
+    parser.add_argument('input', help="CSV or JSONL file of site URLs")
+    parser.add_argument('-o', '--output', default='batch_results.jsonl', help="JSONL file receiving one record per site")
+    parser.add_argument('--workers', type=int, default=DEFAULT_SITE_WORKERS, help="sites crawled at the same time")
+    parser.add_argument('--analysis-workers', type=int, default=DEFAULT_ANALYSIS_WORKERS,
+                        help="LLM analyses running at the same time")
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_BATCH_DEPTH)
+    parser.add_argument('--max-pages', type=int, default=DEFAULT_BATCH_MAX_PAGES, help="page limit per site")
+    parser.add_argument('--mode', choices=('static', 'browser'), default='static')
+    parser.add_argument('--analysis-mode', choices=ANALYSIS_MODES, default=DEFAULT_ANALYSIS_MODE)
+    parser.add_argument('--no-resume', action='store_true', help="start over instead of skipping sites already done")
+    parser.add_argument('--no-page-cache', action='store_true')
+    parser.add_argument('--sitemap', action='store_true', help="seed each crawl from the site's sitemap")
+    parser.add_argument('--incremental', action='store_true',
+                        help="with --sitemap, only refetch pages whose lastmod is newer than the cached copy")
+    parser.add_argument('--extract-workers', type=int, default=DEFAULT_EXTRACT_WORKERS,
+                        help="processes parsing pages while crawls fetch (0 parses inline)")
+    parser.add_argument('--max-page-mb', type=float, default=DEFAULT_MAX_PAGE_BYTES / (1024 * 1024),
+                        help="skip pages larger than this")
+    parser.add_argument('--max-render-seconds', type=float, default=DEFAULT_MAX_RENDER_SECONDS,
+                        help="skip pages that take longer to render")
+    args = parser.parse_args()
+
+    # Forked before the site threads start
+    extractor = ExtractionPool(args.extract_workers)
+    extractor.start()
+    page_cache = None if args.no_page_cache else PageCache()
+    runner = BatchRunner(
+        args.output,
+        site_workers=args.workers,
+        analysis_workers=args.analysis_workers,
+        max_depth=args.max_depth,
+        max_pages=args.max_pages,
+        mode=args.mode,
+        analysis_mode=args.analysis_mode,
+        page_cache=page_cache,
+        use_sitemap=args.sitemap,
+        incremental=args.incremental,
+        extractor=extractor,
+        content_guard=ContentGuard(max_bytes=int(args.max_page_mb * 1024 * 1024),
+                                   max_render_seconds=args.max_render_seconds)
+    )
+    try:
+        summary = runner.run(read_sites(args.input), resume=not args.no_resume)
+        print(f"Batch finished: {summary}")
+    finally:
+        extractor.close()
+        if page_cache is not None:
+            page_cache.close()
+
+
+if __name__ == "__main__":
+    main()
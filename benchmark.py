@@ -0,0 +1,421 @@
+"""
+Offline benchmark of the crawl and analysis pipeline.
+
+Generates a synthetic website, serves it and a stub OpenAI-compatible
+endpoint from local HTTP servers, runs the crawl, page processing and
+analysis against them and reports pages/sec, per-stage latency
+percentiles, peak RSS and tokens sent. Results can be saved as a named
+baseline and later runs compared against it.
+
+    python benchmark.py --pages 300 --save-baseline main
+    python benchmark.py --pages 300 --compare main
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+BASELINE_DIR = 'bench_baselines'
+REPORT_PATH = 'bench_output.txt'
+# A metric this much worse than its baseline counts as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+_WORDS = (
+    "platform service customer solution data cloud team product market industry partner secure "
+    "analytics design growth support network energy health finance retail logistics software "
+    "innovation quality global local office project client experience research strategy value"
+).split()
+
+_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{title}</title></head>
+<body>
+<header><nav><a href="/index.html">Home</a> <a href="/page_1.html">About</a> <a href="/page_2.html">Contact</a></nav></header>
+<main>
+{body}
+</main>
+<footer><p>Synthetic Company Ltd. 1 Benchmark Street, Lisbon, Portugal</p><p>Privacy Policy | Terms of Service</p></footer>
+</body></html>
+"""
+_JS_SHELL = """<!DOCTYPE html>
+<html><head><title>{title}</title></head>
+<body><div id="root"></div><script src="/app.js"></script></body></html>
+"""
+
+
+def _paragraphs(rng, words):
+    paragraphs = []
+    while words > 0:
+        count = min(words, rng.randint(40, 90))
+        paragraphs.append('<p>' + ' '.join(rng.choice(_WORDS) for _ in range(count)).capitalize() + '.</p>')
+        words -= count
+    return '\n'.join(paragraphs)
+
+
+def generate_site(root, pages=200, fanout=8, page_words=400, duplicate_ratio=0.1, js_ratio=0.05, seed=1):
+    """
+    Write a synthetic website into `root`.
+
+    Every page links to the next one (so all pages are reachable) and to
+    `fanout` random others. A `duplicate_ratio` share of pages repeat an
+    earlier page's text with a one-word change, and a `js_ratio` share are
+    empty single-page-app shells whose content only appears when rendered.
+
+    Returns:
+        The number of pages written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    bodies = []
+    for i in range(pages):
+        name = 'index.html' if i == 0 else f'page_{i}.html'
+        links = {(i + 1) % pages} | {rng.randrange(pages) for _ in range(fanout)}
+        link_html = ' '.join(
+            f'<a href="/{"index.html" if j == 0 else f"page_{j}.html"}">Page {j}</a>' for j in sorted(links)
+        )
+        if bodies and rng.random() < duplicate_ratio:
+            text = rng.choice(bodies).replace(rng.choice(_WORDS), rng.choice(_WORDS), 1)
+        else:
+            text = f'<h1>Section {i}</h1>\n' + _paragraphs(rng, page_words)
+        bodies.append(text)
+        body = f'{text}\n<ul><li>{link_html}</li></ul>'
+
+        rendered = _TEMPLATE.format(title=f'Page {i}', body=body)
+        with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+            if i > 0 and rng.random() < js_ratio:
+                f.write(_JS_SHELL.format(title=f'Page {i}'))
+                with open(os.path.join(root, name + '.rendered'), 'w', encoding='utf-8') as rendered_file:
+                    rendered_file.write(rendered)
+            else:
+                f.write(rendered)
+    return pages
+
+
+def _serve(handler_class, state):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _SiteHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        name = parsed.path.lstrip('/') or 'index.html'
+        if parsed.query == 'rendered=1' and os.path.exists(os.path.join(self.server.state['root'], name + '.rendered')):
+            name += '.rendered'
+        path = os.path.join(self.server.state['root'], name)
+        if '..' in name or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        from context_selection import count_tokens
+
+        started = time.monotonic()
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt_tokens = sum(count_tokens(m['content']) for m in body['messages'])
+        time.sleep(self.server.state['latency'])
+        content = ("1. Company/Website Description\nSynthetic Company Ltd.\n"
+                   "2. Key Offerings and Features\nPlatform services.\n"
+                   "3. Market Positioning & Differentiators\nInformation not available\n"
+                   "4. Target Sectors & Use Cases\nRetail, finance.\n"
+                   "5. Team Members\nInformation not available\n"
+                   "6. Company Location\nLisbon, Portugal")
+        with self.server.state['lock']:
+            self.server.state['requests'] += 1
+            self.server.state['prompt_tokens'] += prompt_tokens
+            self.server.state['latencies'].append(time.monotonic() - started)
+        data = json.dumps({
+            'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 60, 'total_tokens': prompt_tokens + 60},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class SimulatedBrowser:
+    """
+    Stand-in for a Chrome WebDriver so the browser fallback runs offline.
+
+    Loading a page fetches its pre-rendered version from the synthetic site
+    after `render_delay` seconds, roughly the cost of a real render.
+    """
+
+    def __init__(self, render_delay=0.2):
+        self.render_delay = render_delay
+        self.page_source = ''
+        self.current_url = None
+        self.window_handles = ['main']
+
+    def get(self, url):
+        time.sleep(self.render_delay)
+        separator = '&' if '?' in url else '?'
+        with urllib.request.urlopen(f'{url}{separator}rendered=1', timeout=10) as response:
+            self.page_source = response.read().decode('utf-8', errors='replace')
+        self.current_url = url
+
+    def execute_script(self, script, *args):
+        return ['complete', 1, 1]
+
+    def quit(self):
+        pass
+
+
+def percentiles(samples):
+    """p50, p90, p99 and max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 2)
+
+    return {'count': len(ordered), 'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99),
+            'max_ms': round(ordered[-1] * 1000, 2)}
+
+
+def run_benchmark(args):
+    """Run the benchmark and return its results dict."""
+    root = tempfile.mkdtemp(prefix='bench_site_')
+    work_dir = tempfile.mkdtemp(prefix='bench_work_')
+    extractor = None
+    try:
+        if args.extract_workers:
+            from extraction_pool import ExtractionPool
+            # Fork the workers before the servers start their threads
+            extractor = ExtractionPool(args.extract_workers)
+            extractor.start()
+        generate_site(root, args.pages, args.fanout, args.page_words, args.duplicate_ratio, args.js_ratio, args.seed)
+        site = _serve(_SiteHandler, {'root': root})
+        llm = _serve(_StubLLMHandler, {'latency': args.llm_latency, 'requests': 0, 'prompt_tokens': 0,
+                                       'latencies': [], 'lock': threading.Lock()})
+
+        # The analyzer reads these when it is first imported
+        os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{llm.server_port}/v1'
+        os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+        os.environ['LLM_CACHE_DISABLED'] = '1'
+
+        from MyCrawler import crawl_and_scrape
+        from driver_pool import DriverPool
+        from extraction import extract_page
+        from page_store import PageStore
+        from politeness import HostScheduler
+        from ai_analyzer import preprocess_content
+        from site_analysis import collect_pages, run_analysis
+
+        start_url = f'http://127.0.0.1:{site.server_port}/index.html'
+        stages = {'crawl': [], 'page': [], 'extract': [], 'collect_pages': [], 'preprocess': [], 'analysis': []}
+        crawled = 0
+        crawl_seconds = 0.0
+
+        for run in range(args.repeat):
+            page_store = PageStore(os.path.join(work_dir, f'run_{run}.db'))
+            pool = DriverPool(lambda: SimulatedBrowser(args.render_delay), size=2)
+            last_event = [time.monotonic()]
+
+            def on_event(event, **data):
+                if event == 'page_parsed':
+                    now = time.monotonic()
+                    stages['page'].append(now - last_event[0])
+                    last_event[0] = now
+
+            try:
+                started = time.monotonic()
+                links, content_map = crawl_and_scrape(
+                    start_url, max_depth=args.max_depth, allowed_domains=[f'127.0.0.1:{site.server_port}'],
+                    mode=args.mode, max_pages=args.pages, driver_pool=pool, page_store=page_store,
+                    scheduler=HostScheduler(rate=1000, burst=1000, max_in_flight=64, respect_robots=False),
+                    concurrency=args.concurrency, on_event=on_event, extractor=extractor
+                )
+                elapsed = time.monotonic() - started
+                links.close()
+                stages['crawl'].append(elapsed)
+                crawl_seconds += elapsed
+                crawled += len(content_map)
+
+                started = time.monotonic()
+                pages, _ = collect_pages(content_map)
+                stages['collect_pages'].append(time.monotonic() - started)
+
+                for _, text in pages:
+                    started = time.monotonic()
+                    preprocess_content(text)
+                    stages['preprocess'].append(time.monotonic() - started)
+
+                started = time.monotonic()
+                result = run_analysis(pages, args.analysis_mode)
+                stages['analysis'].append(time.monotonic() - started)
+                if not result['success']:
+                    raise RuntimeError(f"Analysis failed: {result.get('error')}")
+            finally:
+                pool.close()
+                page_store.delete()
+
+        # Parsing cost on its own, without network or scheduling
+        for name in sorted(os.listdir(root)):
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                html = f.read()
+            started = time.monotonic()
+            extract_page(f'{start_url.rsplit("/", 1)[0]}/{name}', html)
+            stages['extract'].append(time.monotonic() - started)
+
+        site.shutdown()
+        llm.shutdown()
+
+        return {
+            'config': {key: getattr(args, key) for key in (
+                'pages', 'fanout', 'page_words', 'duplicate_ratio', 'js_ratio', 'seed', 'mode', 'analysis_mode',
+                'concurrency', 'max_depth', 'llm_latency', 'render_delay', 'repeat', 'extract_workers')},
+            'pages_crawled': crawled,
+            'pages_per_sec': round(crawled / crawl_seconds, 2) if crawl_seconds else 0.0,
+            'stages': {name: percentiles(samples) for name, samples in stages.items()},
+            'llm': {
+                'requests': llm.state['requests'],
+                'prompt_tokens': llm.state['prompt_tokens'],
+                'latency': percentiles(llm.state['latencies']),
+            },
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    finally:
+        if extractor is not None:
+            extractor.close()
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _flatten(results):
+    """Metric name -> (value, True if higher is better) for baseline comparison."""
+    metrics = {'pages_per_sec': (results['pages_per_sec'], True),
+               'peak_rss_mb': (results['peak_rss_mb'], False),
+               'llm.prompt_tokens': (results['llm']['prompt_tokens'], False)}
+    for stage, values in results['stages'].items():
+        for key in ('p50_ms', 'p90_ms'):
+            if key in values:
+                metrics[f'{stage}.{key}'] = (values[key], False)
+    return metrics
+
+
+def compare(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compare results with a baseline.
+
+    Returns:
+        A tuple (report lines, list of regressed metric names).
+    """
+    lines = []
+    regressions = []
+    current = _flatten(results)
+    for name, (old, higher_is_better) in _flatten(baseline).items():
+        if name not in current:
+            continue
+        new = current[name][0]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = '  improved'
+        lines.append(f"{name:<26} {old:>12} -> {new:>12} ({change:+.1%}){flag}")
+    return lines, regressions
+
+
+def format_report(results):
+    lines = [
+        f"Pages crawled: {results['pages_crawled']} ({results['pages_per_sec']} pages/sec)",
+        f"Peak RSS: {results['peak_rss_mb']} MB",
+        f"LLM requests: {results['llm']['requests']}, prompt tokens sent: {results['llm']['prompt_tokens']}",
+        '',
+        f"{'stage':<16}{'count':>8}{'p50 ms':>12}{'p90 ms':>12}{'p99 ms':>12}{'max ms':>12}",
+    ]
+    for stage, values in list(results['stages'].items()) + [('llm_request', results['llm']['latency'])]:
+        if values:
+            lines.append(f"{stage:<16}{values['count']:>8}{values['p50_ms']:>12}{values['p90_ms']:>12}"
+                         f"{values['p99_ms']:>12}{values['max_ms']:>12}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the crawl and analysis pipeline.")
+    parser.add_argument('--pages', type=int, default=200, help="pages in the synthetic site")
+    parser.add_argument('--fanout', type=int, default=8, help="random links per page")
+    parser.add_argument('--page-words', type=int, default=400, help="words of text per page")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help="share of near-duplicate pages")
+    parser.add_argument('--js-ratio', type=float, default=0.05, help="share of pages that need rendering")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mode', choices=('static', 'browser'), default='static')
+    parser.add_argument('--analysis-mode', choices=('select', 'map_reduce'), default='select')
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent requests in static mode")
+    parser.add_argument('--extract-workers', type=int, default=0,
+                        help="extraction worker processes (0 parses inline in the crawl loop)")
+    parser.add_argument('--max-depth', type=int, default=50)
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="seconds the stub LLM takes per request")
+    parser.add_argument('--render-delay', type=float, default=0.2, help="seconds the simulated browser takes per page")
+    parser.add_argument('--repeat', type=int, default=1, help="number of crawl and analysis runs")
+    parser.add_argument('--save-baseline', metavar='NAME', help=f"save the results as {BASELINE_DIR}/NAME.json")
+    parser.add_argument('--compare', metavar='NAME', help="compare with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    lines = format_report(results)
+
+    regressions = []
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json'), encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['config'] != results['config']:
+            lines += ['', 'Warning: baseline was recorded with a different configuration']
+        comparison, regressions = compare(results, baseline, args.threshold)
+        lines += ['', f"Compared with baseline '{args.compare}':"] + comparison
+
+    report = '\n'.join(lines)
+    print('\n' + report)
+    with open(REPORT_PATH, 'w', encoding='utf-8') as f:
+        f.write(report + '\n')
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f'{args.save_baseline}.json'), 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {BASELINE_DIR}/{args.save_baseline}.json")
+
+    if regressions:
+        raise SystemExit(f"{len(regressions)} metrics regressed: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from collections import Counter
+
+# A block must recur on at least this many pages ...
+DEFAULT_MIN_PAGES = 3
+# ... and on at least this fraction of them to count as site template
+DEFAULT_THRESHOLD = 0.5
+
+
+def _normalize(line):
+    return ' '.join(line.split())
+
+
+def _is_template_line(line, template, by_length):
+    """A line is template if it is made up only of template blocks."""
+    if line in template:
+        return True
+    for text in by_length:
+        if text in line:
+            line = line.replace(text, '')
+    return not any(char.isalnum() for char in line)
+
+
+class TemplateDetector:
+    """
+    Learns a site's template (menus, footers, cookie banners) from its pages.
+
+    Every page contributes the set of (DOM path, text) blocks it contains.
+    Blocks that recur on at least `threshold` of the pages, and on no fewer
+    than `min_pages`, are template; clean() drops their lines from a page.
+    With fewer pages than `min_pages` nothing is treated as template.
+    """
+
+    def __init__(self, min_pages=DEFAULT_MIN_PAGES, threshold=DEFAULT_THRESHOLD):
+        self.min_pages = min_pages
+        self.threshold = threshold
+        self.pages = 0
+        self._counts = Counter()
+
+    @classmethod
+    def fit(cls, docs, **kwargs):
+        """Build a detector from an iterable of PageDocuments."""
+        detector = cls(**kwargs)
+        for doc in docs:
+            detector.add(doc)
+        return detector
+
+    def add(self, doc):
+        self.pages += 1
+        self._counts.update({(path, text) for path, text in doc.blocks})
+
+    def _min_count(self):
+        return max(self.min_pages, self.threshold * self.pages)
+
+    def template_texts(self, doc):
+        """Texts of the page's blocks that belong to the site template."""
+        if self.pages < self.min_pages:
+            return set()
+        min_count = self._min_count()
+        return {text for path, text in doc.blocks if self._counts[(path, text)] >= min_count}
+
+    def clean(self, doc):
+        """Return the page's content text without template lines."""
+        text = doc.content_text
+        template = self.template_texts(doc)
+        if not template:
+            return text
+        # Adjacent inline blocks can share a line, so longer blocks are removed first
+        by_length = sorted(template, key=len, reverse=True)
+        return '\n'.join(
+            line for line in text.splitlines()
+            if not _is_template_line(_normalize(line), template, by_length)
+        )
@@ -0,0 +1,72 @@
+import gzip
+import json
+import os
+import time
+
+# Seconds between checkpoints of a running crawl
+DEFAULT_CHECKPOINT_INTERVAL = 30
+
+# Stages of a crawl task in the order they are reached
+STAGES = ('crawling', 'crawled', 'analyzed', 'completed')
+
+
+class CrawlCheckpoint:
+    """
+    Periodic snapshot of a crawl task, kept in a gzipped JSON file.
+
+    It holds the task's parameters, the stage it reached, and the crawl
+    state: frontier queue and seen URLs, visited URLs and skipped URLs. The
+    pages themselves are already durable in the task's PageStore, and the
+    discovered links in a log at `links_path` of which only the length is
+    recorded. Writes go to a temporary file that replaces the old one, so
+    a crash mid-write leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, path, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.links_path = f"{path[:-len('.json.gz')] if path.endswith('.json.gz') else path}.links"
+        self.interval = interval
+        self.data = self._load()
+        self._last_save = time.monotonic()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return {}
+
+    def exists(self):
+        return bool(self.data)
+
+    @property
+    def stage(self):
+        return self.data.get('stage')
+
+    def reached(self, stage):
+        """Whether the task got at least as far as `stage`."""
+        return self.stage in STAGES and STAGES.index(self.stage) >= STAGES.index(stage)
+
+    def due(self):
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, **fields):
+        """Merge `fields` into the checkpoint and write it to disk."""
+        self.data.update(fields)
+        self.data['saved_at'] = time.time()
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def delete(self):
+        self.data = {}
+        for path in (self.path, f"{self.path}.tmp", self.links_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+
+from fetcher import USER_AGENT, DEFAULT_TIMEOUT, content_skip_reason
+
+# Largest page body loaded, parsed or stored
+DEFAULT_MAX_PAGE_BYTES = 5 * 1024 * 1024
+# Longest a page may take to render in the browser
+DEFAULT_MAX_RENDER_SECONDS = 30
+# Per-URL content checks remembered, least recently used dropped first
+MAX_CACHED_VERDICTS = 100000
+
+# Link targets that are never HTML pages
+NON_HTML_EXTENSIONS = {
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.ods', '.odp', '.rtf', '.csv',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.tar', '.dmg', '.exe', '.msi', '.apk', '.iso', '.bin',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.ico', '.bmp', '.tif', '.tiff', '.heic',
+    '.mp4', '.webm', '.ogg', '.ogv', '.mp3', '.wav', '.m4a', '.m4v', '.mov', '.avi', '.mkv', '.flac',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot',
+    '.css', '.js', '.json', '.xml', '.rss', '.atom', '.txt', '.ics', '.vcf'
+}
+
+
+def extension_skip_reason(url):
+    """Return 'extension: .pdf' and the like for URLs whose path names a non-HTML file, else None."""
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if extension in NON_HTML_EXTENSIONS:
+        return f"extension: {extension}"
+    return None
+
+
+class ContentGuard:
+    """
+    Keeps non-HTML resources and oversized pages out of the browser and
+    the parser.
+
+    URLs are screened by extension first. Before a browser render, a HEAD
+    request (or, where HEAD is refused, a GET closed after the headers)
+    checks the Content-Type and Content-Length. Each verdict is cached per
+    URL, including those learned from static fetches, so a URL is checked
+    over the network at most once. Share one guard across crawls to share
+    the cache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_PAGE_BYTES, max_render_seconds=DEFAULT_MAX_RENDER_SECONDS,
+                 timeout=DEFAULT_TIMEOUT, max_entries=MAX_CACHED_VERDICTS):
+        self.max_bytes = max_bytes
+        self.max_render_seconds = max_render_seconds
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, url, reason):
+        """Cache a URL's verdict: a skip reason, or None for an HTML page."""
+        with self._lock:
+            self._verdicts[url] = reason
+            self._verdicts.move_to_end(url)
+            while len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+
+    def _lookup(self, url):
+        """(True, verdict) if the URL's verdict is cached, else (False, None)."""
+        with self._lock:
+            if url not in self._verdicts:
+                return False, None
+            self._verdicts.move_to_end(url)
+            return True, self._verdicts[url]
+
+    def check_url(self, url):
+        """
+        Screen a URL without touching the network.
+
+        Returns:
+            A skip reason, or None if the URL may be an HTML page.
+        """
+        return extension_skip_reason(url) or self._lookup(url)[1]
+
+    def check_response(self, url, headers):
+        """Judge and remember a URL by the headers of a response to it."""
+        reason = content_skip_reason(headers.get('Content-Type'), headers.get('Content-Length'), self.max_bytes)
+        self.remember(url, reason)
+        return reason
+
+    def probe(self, url, scheduler=None):
+        """
+        Screen a URL before it is rendered, asking the server for its
+        headers unless the verdict is cached. Requests go through
+        `scheduler`, a HostScheduler, when given. Failed requests are not
+        cached and let the URL through.
+
+        Returns:
+            A skip reason, or None to render the page.
+        """
+        reason = extension_skip_reason(url)
+        if reason:
+            return reason
+        known, reason = self._lookup(url)
+        if known:
+            return reason
+
+        if scheduler is not None:
+            scheduler.acquire_sync(url)
+        started = time.monotonic()
+        status = None
+        try:
+            headers = {'User-Agent': USER_AGENT}
+            response = requests.head(url, headers=headers, timeout=self.timeout, allow_redirects=True)
+            status = response.status_code
+            if status in (405, 501):
+                # HEAD not supported: read the headers of a GET and drop the body
+                with requests.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    status = response.status_code
+            if status >= 400:
+                return None
+            return self.check_response(url, response.headers)
+        except requests.RequestException as e:
+            print(f"Could not check content type of {url}: {e}")
+            return None
+        finally:
+            if scheduler is not None:
+                scheduler.release(url, status, time.monotonic() - started)
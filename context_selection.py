@@ -0,0 +1,197 @@
+import math
+import re
+import threading
+from collections import Counter
+
+# Use the model's real tokenizer when tiktoken is installed
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Loaded on first use: a cold tiktoken cache downloads the BPE file
+_ENCODING = None
+_ENCODING_LOADED = False
+_ENCODING_LOCK = threading.Lock()
+
+DEFAULT_CONTEXT_TOKENS = 1500
+CHUNK_TOKENS = 120
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# One query per section of the report (English and Portuguese terms)
+SECTION_QUERIES = {
+    'description': 'about us company who we are mission vision history founded quem somos sobre nós empresa missão',
+    'offerings': 'products services solutions offer offering platform features pricing produtos serviços servicos '
+                 'soluções solucoes oferecemos',
+    'positioning': 'leader leading unique differentiator why choose award innovative expertise experience trusted '
+                   'líder diferencial inovação experiência',
+    'sectors': 'industries industry sectors markets clients customers use cases partners portfolio '
+               'setores sectores clientes mercados parceiros',
+    'team': 'team leadership founder founders ceo cto cfo director managing partner board management '
+            'equipa equipe liderança fundador diretor administração',
+    'location': 'address headquarters office offices contact street avenue city country located '
+                'sede morada endereço localização contactos avenida rua',
+}
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _get_encoding():
+    """The cl100k_base encoding, or None if tiktoken is missing or cannot load it."""
+    global _ENCODING, _ENCODING_LOADED
+    if not _ENCODING_LOADED:
+        with _ENCODING_LOCK:
+            if not _ENCODING_LOADED:
+                if tiktoken is not None:
+                    try:
+                        _ENCODING = tiktoken.get_encoding("cl100k_base")
+                    except Exception as e:
+                        print(f"Could not load the tiktoken encoding, approximating token counts: {e}")
+                _ENCODING_LOADED = True
+    return _ENCODING
+
+
+def count_tokens(text):
+    """Number of model tokens in a text (approximated if tiktoken is missing)."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def _terms(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def chunk_pages(pages, chunk_tokens=CHUNK_TOKENS):
+    """
+    Split page texts into chunks of roughly `chunk_tokens` tokens along line boundaries.
+
+    Args:
+        pages: Iterable of (url, text) pairs.
+
+    Returns:
+        A list of dicts with url, page, position, text, tokens and terms.
+    """
+    chunks = []
+    for page_index, (url, text) in enumerate(pages):
+        lines = []
+        tokens = 0
+        for line in _split_long_lines(text, chunk_tokens):
+            line_tokens = count_tokens(line)
+            if lines and tokens + line_tokens > chunk_tokens:
+                chunks.append(_make_chunk(url, page_index, len(chunks), lines, tokens))
+                lines, tokens = [], 0
+            lines.append(line)
+            tokens += line_tokens
+        if lines:
+            chunks.append(_make_chunk(url, page_index, len(chunks), lines, tokens))
+    return chunks
+
+
+def _split_long_lines(text, chunk_tokens):
+    """Yield the non-blank lines of a text, breaking lines longer than a chunk at word boundaries."""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if count_tokens(line) <= chunk_tokens:
+            yield line
+            continue
+        words = line.split()
+        # Assume roughly 0.75 words per token
+        step = max(1, int(chunk_tokens * 0.75))
+        for start in range(0, len(words), step):
+            yield ' '.join(words[start:start + step])
+
+
+def _make_chunk(url, page_index, position, lines, tokens):
+    text = '\n'.join(lines)
+    return {'url': url, 'page': page_index, 'position': position, 'text': text,
+            'tokens': tokens, 'terms': Counter(_terms(text))}
+
+
+def bm25_scores(chunks, query):
+    """BM25 score of every chunk for a query."""
+    if not chunks:
+        return []
+    query_terms = set(_terms(query))
+    average_length = sum(sum(chunk['terms'].values()) for chunk in chunks) / len(chunks) or 1
+    document_frequency = Counter(term for chunk in chunks for term in query_terms if term in chunk['terms'])
+
+    scores = []
+    for chunk in chunks:
+        length = sum(chunk['terms'].values())
+        score = 0.0
+        for term in query_terms:
+            frequency = chunk['terms'].get(term, 0)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+        # Pages whose URL names the section (e.g. /about, /team, /contact) are a strong signal
+        if query_terms.intersection(_terms(chunk['url'])):
+            score *= 1.5
+        scores.append(score)
+    return scores
+
+
+def select_context(pages, max_tokens=DEFAULT_CONTEXT_TOKENS, queries=None):
+    """
+    Pack the most relevant chunks of all pages into a token budget.
+
+    The opening chunk of the first page is always kept. Then each
+    section query in turn takes its best-ranked remaining chunk until the
+    budget is spent or no chunk matches. Leftover budget is filled in
+    crawl order. Selected chunks are returned in document order, grouped
+    under their source URL.
+    """
+    queries = queries or SECTION_QUERIES
+    chunks = chunk_pages(pages)
+    if not chunks:
+        return ''
+
+    rankings = []
+    for query in queries.values():
+        scores = bm25_scores(chunks, query)
+        rankings.append([i for score, i in sorted(((s, i) for i, s in enumerate(scores)), reverse=True)
+                         if score > 0])
+
+    selected = set()
+    used = 0
+
+    def take(index):
+        nonlocal used
+        if index in selected or used + chunks[index]['tokens'] > max_tokens:
+            return False
+        selected.add(index)
+        used += chunks[index]['tokens']
+        return True
+
+    take(0)
+    progressed = True
+    while progressed:
+        progressed = False
+        for ranking in rankings:
+            while ranking:
+                index = ranking.pop(0)
+                if take(index):
+                    progressed = True
+                    break
+    for index in range(len(chunks)):
+        take(index)
+
+    parts = []
+    current_url = None
+    for index in sorted(selected):
+        chunk = chunks[index]
+        if chunk['url'] != current_url:
+            current_url = chunk['url']
+            parts.append(f"Source: {current_url}")
+        parts.append(chunk['text'])
+    print(f"Selected {len(selected)} of {len(chunks)} chunks ({used} tokens)")
+    return '\n\n'.join(parts)
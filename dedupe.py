@@ -0,0 +1,101 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+
+FINGERPRINT_BITS = 64
+# Pages whose fingerprints differ in at most this many bits are near-duplicates
+DEFAULT_MAX_DISTANCE = 3
+# Words per shingle
+SHINGLE_SIZE = 3
+# Texts with fewer words get no fingerprint: empty and near-empty pages
+# (image-only hubs, consent walls, JS shells) all look alike
+MIN_WORDS = 10
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_HASH_BYTES = FINGERPRINT_BITS // 8
+# _BIT_TABLES[j] maps each byte to its bit j, for bytes.translate
+_BIT_TABLES = [bytes((value >> j) & 1 for value in range(256)) for j in range(8)]
+
+
+def simhash(text):
+    """
+    64-bit SimHash of a text over lowercase word shingles, or None for
+    texts of fewer than MIN_WORDS words, which are never near-duplicates.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    features = Counter(map(' '.join, zip(*(words[i:] for i in range(SHINGLE_SIZE)))))
+
+    # Feature hashes packed end to end, each repeated by its count. Every
+    # bit's weight is then counted in C over one byte column of the packed
+    # hashes instead of per feature and bit in Python.
+    blake2b = hashlib.blake2b
+    packed = b''.join(blake2b(feature.encode('utf-8'), digest_size=_HASH_BYTES).digest() * count
+                      for feature, count in features.items())
+    total = len(packed) // _HASH_BYTES
+
+    fingerprint = 0
+    for byte in range(_HASH_BYTES):
+        # Hashes are big-endian: bits 0-7 are in the last byte of each
+        column = packed[_HASH_BYTES - 1 - byte::_HASH_BYTES]
+        for j, table in enumerate(_BIT_TABLES):
+            ones = column.translate(table).count(1)
+            # Weight: +count for each feature with the bit set, -count otherwise
+            if 2 * ones > total:
+                fingerprint |= 1 << (8 * byte + j)
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """
+    Finds pages whose SimHash is within `max_distance` bits of a page seen before.
+
+    Fingerprints are split into max_distance + 1 bands; two fingerprints that
+    differ in at most max_distance bits must agree exactly on at least one
+    band, so only pages sharing a band are compared.
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.bands
+        self._tables = [defaultdict(list) for _ in range(self.bands)]
+        self.clusters = defaultdict(list)
+
+    def _band_values(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def find(self, fingerprint):
+        """Return the URL of a near-duplicate already in the index, or None."""
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            for other, url in table.get(value, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return url
+        return None
+
+    def add(self, fingerprint, url):
+        for table, value in zip(self._tables, self._band_values(fingerprint)):
+            table[value].append((fingerprint, url))
+
+    def check(self, fingerprint, url):
+        """
+        Index a page unless it is a near-duplicate. Pages without a
+        fingerprint are never indexed nor matched.
+
+        Returns:
+            The URL of the page it duplicates, or None if it was added as new.
+        """
+        if fingerprint is None:
+            return None
+        original = self.find(fingerprint)
+        if original is None:
+            self.add(fingerprint, url)
+        else:
+            self.clusters[original].append(url)
+        return original
@@ -0,0 +1,176 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 2
+# Restart a browser after this many pages to contain Chrome memory growth
+DEFAULT_MAX_PAGES_PER_DRIVER = 50
+
+
+def is_healthy(driver):
+    """Return True if the WebDriver session still responds."""
+    try:
+        driver.window_handles
+        return True
+    except Exception:
+        return False
+
+
+class DriverPool:
+    """
+    A pool of warm Selenium WebDriver instances shared across crawl tasks.
+
+    Drivers are created lazily up to `size`, handed out with checkout/checkin
+    (or the `driver()` context manager), health-checked on checkout and
+    recycled after `max_pages_per_driver` pages.
+    """
+
+    def __init__(self, factory=None, size=DEFAULT_POOL_SIZE, max_pages_per_driver=DEFAULT_MAX_PAGES_PER_DRIVER,
+                 drivers=None):
+        """
+        Args:
+            factory: Callable returning a new WebDriver. May be None when the
+                pool only wraps externally managed `drivers`.
+            size: Maximum number of drivers alive at once.
+            max_pages_per_driver: Pages rendered before a driver is recycled.
+            drivers: Existing drivers to lend to the pool. They are never
+                recycled or quit by the pool.
+        """
+        self.factory = factory
+        self.size = max(size, len(drivers or []))
+        self.max_pages_per_driver = max_pages_per_driver
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._page_counts = {}
+        self._external = set()
+        self._closed = False
+
+        for driver in drivers or []:
+            self._external.add(id(driver))
+            self._page_counts[id(driver)] = 0
+            self._created += 1
+            self._idle.put(driver)
+
+    @classmethod
+    def from_driver(cls, driver):
+        """Wrap a single caller-owned driver in a pool of size one."""
+        return cls(size=1, drivers=[driver])
+
+    def warm(self, count=None):
+        """Start drivers ahead of time so the first tasks don't pay Chrome startup."""
+        count = self.size if count is None else min(count, self.size)
+        started = []
+        while self._created < count:
+            started.append(self.checkout())
+        for driver in started:
+            self.checkin(driver, pages=0)
+
+    def checkout(self, timeout=None):
+        """Take a healthy driver from the pool, starting one if under capacity."""
+        if self._closed:
+            raise RuntimeError("Driver pool is closed")
+
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = None
+                with self._lock:
+                    can_create = self.factory is not None and self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        driver = self.factory()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    self._page_counts[id(driver)] = 0
+                    return driver
+                if self._created == 0:
+                    raise RuntimeError("No browser available in driver pool")
+                driver = self._idle.get(timeout=timeout)
+
+            if is_healthy(driver):
+                return driver
+            print("Discarding unresponsive browser from pool")
+            self._discard(driver)
+
+    def checkin(self, driver, pages=1):
+        """Return a driver to the pool, recycling it if it is worn out or broken."""
+        key = id(driver)
+        self._page_counts[key] = self._page_counts.get(key, 0) + pages
+
+        if self._closed:
+            self._discard(driver)
+            return
+
+        worn_out = (key not in self._external and
+                    self._page_counts[key] >= self.max_pages_per_driver)
+        if worn_out or not is_healthy(driver):
+            print(f"Recycling browser after {self._page_counts[key]} pages")
+            self._discard(driver)
+            return
+        self._idle.put(driver)
+
+    def _discard(self, driver):
+        key = id(driver)
+        self._page_counts.pop(key, None)
+        if key in self._external:
+            # Never quit a caller-owned driver; just stop handing it out
+            self._external.discard(key)
+        else:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """Context manager that checks out a driver and always checks it back in."""
+        driver = self.checkout(timeout=timeout)
+        try:
+            yield driver
+        finally:
+            self.checkin(driver)
+
+    def run(self, fn, url):
+        """Call fn(driver, url) with a pooled driver."""
+        with self.driver() as driver:
+            return fn(driver, url)
+
+    def map(self, fn, urls):
+        """
+        Call fn(driver, url) for every URL in parallel across the pool.
+
+        Returns:
+            A list of results in the same order as `urls`; failed calls
+            yield None.
+        """
+        def safe_run(url):
+            try:
+                return self.run(fn, url)
+            except Exception as e:
+                print(f"Error rendering {url}: {e}")
+                return None
+
+        urls = list(urls)
+        if len(urls) <= 1 or self.size == 1:
+            return [safe_run(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(self.size, len(urls))) as executor:
+            return list(executor.map(safe_run, urls))
+
+    def close(self):
+        """Quit every idle driver owned by the pool."""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
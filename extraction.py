@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup, NavigableString
+
+from dedupe import simhash
+from metrics import span
+
+# Prefer the C-accelerated lxml parser when it is installed
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+LIST_TAGS = ['ul', 'ol', 'li']
+
+# Text blocks longer than this are page content, never template boilerplate
+MAX_BLOCK_CHARS = 300
+# Number of ancestor tags recorded in a block's DOM path
+BLOCK_PATH_DEPTH = 8
+# Text inside these elements is left out of the near-duplicate fingerprint
+CHROME_TAGS = {'nav', 'header', 'footer', 'aside', 'form'}
+
+
+@dataclass
+class PageDocument:
+    """Everything the crawler, analyzer and output files need from one page."""
+    url: str
+    title: str = ''
+    links: List[str] = field(default_factory=list)
+    text: str = ''
+    filtered_text: Optional[str] = None
+    # [dom_path, text] for each short text node, used to detect site templates
+    blocks: List[List[str]] = field(default_factory=list)
+    # SimHash of the main content, and the page it near-duplicates if any
+    simhash: Optional[int] = None
+    duplicate_of: Optional[str] = None
+
+    @property
+    def content_text(self):
+        """The filtered-tag text when content filters were applied, else the full text."""
+        return self.filtered_text if self.filtered_text is not None else self.text
+
+
+def get_allowed_tags(filters):
+    """Map the UI filter codes (p, h, l) to the HTML tags they select."""
+    tags = []
+    if 'p' in filters:
+        tags.extend(['p'])
+    if 'h' in filters:
+        tags.extend(HEADING_TAGS)
+    if 'l' in filters:
+        tags.extend(LIST_TAGS)
+    return tags if tags else None
+
+
+def clean_text(text):
+    """Strip each line, split multi-space runs into separate lines and drop blanks."""
+    # Break into lines and remove leading/trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # Break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Drop blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def extract_filtered_content(soup, allowed_tags=None):
+    """Return the text of the allowed tags in document order, or all text if none given."""
+    if allowed_tags:
+        # A single tree walk for all tags keeps elements in document order
+        texts = (elem.get_text().strip() for elem in soup.find_all(allowed_tags))
+        return '\n'.join(text for text in texts if text)
+    else:
+        # Extract all text if no tags specified
+        return soup.get_text()
+
+
+def dom_path(element):
+    """Tag-name path of an element's nearest ancestors down to it, e.g. body>footer>ul>li."""
+    names = []
+    while element is not None and element.name not in (None, '[document]') and len(names) < BLOCK_PATH_DEPTH:
+        names.append(element.name)
+        element = element.parent
+    return '>'.join(reversed(names))
+
+
+def extract_blocks(soup):
+    """
+    Walk the text nodes of a page once.
+
+    Returns:
+        A tuple ([dom_path, text] pairs for the short text nodes, text of
+        the nodes outside navigation, header, footer and aside elements).
+    """
+    blocks = []
+    main_text = []
+    for string in soup.find_all(string=True):
+        # Skip comments, doctypes and other non-content strings
+        if type(string) is not NavigableString:
+            continue
+        text = ' '.join(string.split())
+        if not text:
+            continue
+        path = dom_path(string.parent)
+        if len(text) <= MAX_BLOCK_CHARS:
+            blocks.append([path, text])
+        if not CHROME_TAGS.intersection(path.split('>')):
+            main_text.append(text)
+    return blocks, ' '.join(main_text)
+
+
+def extract_page(url, html, allowed_tags=None, base_url=None):
+    """
+    Parse a page once and extract everything later stages need.
+
+    Args:
+        url: The page URL, used to resolve relative links.
+        html: The page HTML.
+        allowed_tags: Tags to keep for filtered_text (see get_allowed_tags).
+        base_url: The URL the page was actually served from after
+            redirects, which relative links are resolved against instead
+            of `url` (optional).
+
+    Returns:
+        A PageDocument.
+    """
+    with span('parse'):
+        soup = BeautifulSoup(html, PARSER)
+
+    with span('extract'):
+        return extract_document(url, soup, allowed_tags, base_url)
+
+
+def extract_document(url, soup, allowed_tags=None, base_url=None):
+    """Build the PageDocument of a parsed page. Removes its script and style elements."""
+    title = soup.title.get_text().strip() if soup.title else ''
+
+    # Links resolve against the final URL, or the page's <base href> if it has one
+    base_url = base_url or url
+    base = soup.find('base', href=True)
+    if base is not None:
+        base_url = urljoin(base_url, base['href'])
+    links = []
+    for link in soup.find_all("a", href=True):
+        absolute_url = urljoin(base_url, link["href"])
+        if urlparse(absolute_url).scheme in ("http", "https"):
+            links.append(absolute_url)
+
+    # Remove unwanted elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    text = clean_text(soup.get_text())
+    filtered_text = clean_text(extract_filtered_content(soup, allowed_tags)) if allowed_tags else None
+
+    blocks, main_text = extract_blocks(soup)
+    # Pages with (almost) no text get no fingerprint and are never near-duplicates
+    fingerprint = simhash(main_text)
+    if fingerprint is None:
+        fingerprint = simhash(text)
+
+    return PageDocument(url=url, title=title, links=links, text=text, filtered_text=filtered_text,
+                        blocks=blocks, simhash=fingerprint)
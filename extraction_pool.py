@@ -0,0 +1,259 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bs4 import BeautifulSoup
+
+from extraction import PARSER, extract_document, extract_page
+from metrics import ERRORS, record_span
+
+DEFAULT_EXTRACT_WORKERS = os.cpu_count() or 1
+# Pages waiting for or in extraction per worker before submit() blocks
+PENDING_PER_WORKER = 4
+# How often workers check that the process that started them is alive
+PARENT_CHECK_SECONDS = 1
+
+
+def _extract_timed(url, html, allowed_tags, base_url=None):
+    """Run in a worker process: extract a page and time its parse and extract stages."""
+    started = time.perf_counter()
+    soup = BeautifulSoup(html, PARSER)
+    parsed = time.perf_counter()
+    doc = extract_document(url, soup, allowed_tags, base_url)
+    return doc, [('parse', started, parsed - started), ('extract', parsed, time.perf_counter() - parsed)]
+
+
+def _noop():
+    return None
+
+
+def _watch_parent(parent_pid):
+    """
+    Run in each worker process: exit once the parent is gone. A worker
+    forked from a killed parent would otherwise wait forever on the task
+    queue, whose write end it inherited.
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(PARENT_CHECK_SECONDS)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class PendingExtraction:
+    """A page handed to the extraction pool; result() waits for its PageDocument."""
+
+    def __init__(self, pool, executor, url, html, allowed_tags, future, base_url=None):
+        self.pool = pool
+        self.executor = executor
+        self.url = url
+        self.html = html
+        self.allowed_tags = allowed_tags
+        self.base_url = base_url
+        self.future = future
+
+    def result(self, trace=None):
+        """
+        Wait for the PageDocument. Worker timings go to the metrics and to
+        `trace` (or the current task trace). If the pool broke, the page is
+        extracted here instead.
+        """
+        try:
+            doc, spans = self.future.result()
+        except BrokenProcessPool:
+            print(f"Extraction worker died; extracting {self.url} inline")
+            self.pool.drop_broken(self.executor)
+            return extract_page(self.url, self.html, self.allowed_tags, self.base_url)
+        except Exception:
+            ERRORS.inc(stage='extract')
+            raise
+        # Worker spans keep their perf_counter start times, which are
+        # comparable across processes where the clock is system-wide (Linux)
+        for stage, started, seconds in spans:
+            record_span(stage, started, seconds, trace, url=self.url)
+        return doc
+
+    async def wait(self):
+        """Wait for the worker without blocking the event loop; result() is then immediate."""
+        await asyncio.wait([asyncio.wrap_future(self.future)])
+
+
+class ExtractionPool:
+    """
+    Worker processes that turn raw HTML into PageDocuments while the crawl
+    keeps fetching.
+
+    Crawl loops submit() each page as soon as it arrives and collect the
+    documents in frontier order with PendingExtraction.result(), so the
+    crawl stays deterministic however the workers interleave. At most
+    `max_pending` pages are queued or in extraction at once; beyond that
+    submit() blocks, holding back the fetchers instead of piling up HTML.
+
+    Coroutines use submit_async(), which waits for a free slot without
+    blocking the event loop, so the other fetches keep going meanwhile.
+
+    With `workers=0` pages are extracted inline on submit(). A pool whose
+    workers died also extracts inline from then on, rather than forking
+    again from a process that by then runs other threads.
+    """
+
+    def __init__(self, workers=DEFAULT_EXTRACT_WORKERS, max_pending=None):
+        self.workers = max(workers, 0)
+        self.max_pending = max_pending or max(self.workers, 1) * PENDING_PER_WORKER
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        # Process that started the executor; a forked child starts its own
+        self._pid = None
+        # (loop, future) of coroutines waiting in submit_async for a slot
+        self._waiters = []
+        self._closed = False
+
+    def _get_executor(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Extraction pool is closed")
+            if self._executor is not None and self._pid != os.getpid():
+                # Inherited across a fork (e.g. gunicorn --preload): the workers
+                # and the management thread belong to the parent
+                self._executor = None
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._waiters = []
+            if self._executor is None:
+                # Forked workers start in milliseconds and, unlike spawned ones,
+                # do not re-import the main module (app.py would start its
+                # threads and task queue in every worker)
+                context = None
+                if 'fork' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('fork')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                     initializer=_watch_parent, initargs=(os.getpid(),))
+                self._pid = os.getpid()
+            return self._executor
+
+    def start(self):
+        """
+        Start the worker processes now. Call it before the program starts
+        threads: a process forked while another thread holds a lock can
+        hang on that lock.
+        """
+        if self.workers:
+            self._get_executor().submit(_noop).result()
+
+    def submit(self, url, html, allowed_tags=None, base_url=None):
+        """
+        Queue a page for extraction, waiting while `max_pending` pages are
+        already in the pool. `base_url` is as in extract_page.
+
+        Returns:
+            A PendingExtraction.
+        """
+        if not self.workers:
+            return self._submit_inline(url, html, allowed_tags, base_url)
+        slots = self._get_slots()
+        slots.acquire()
+        return self._submit_acquired(slots, url, html, allowed_tags, base_url)
+
+    async def submit_async(self, url, html, allowed_tags=None, base_url=None):
+        """
+        submit() for coroutines: while the pool is full, wait for a slot
+        without blocking the event loop.
+
+        Returns:
+            A PendingExtraction.
+        """
+        if not self.workers:
+            return self._submit_inline(url, html, allowed_tags, base_url)
+        slots = self._get_slots()
+        loop = asyncio.get_running_loop()
+        while not slots.acquire(blocking=False):
+            waiter = loop.create_future()
+            with self._lock:
+                self._waiters.append((loop, waiter))
+            # A slot freed before the waiter was registered would not wake it
+            if slots.acquire(blocking=False):
+                break
+            await waiter
+        return self._submit_acquired(slots, url, html, allowed_tags, base_url)
+
+    def _get_slots(self):
+        if self._pid is not None and self._pid != os.getpid():
+            self._get_executor()
+        return self._slots
+
+    def _submit_inline(self, url, html, allowed_tags, base_url):
+        future = _completed(_extract_timed, url, html, allowed_tags, base_url)
+        return PendingExtraction(self, None, url, html, allowed_tags, future, base_url)
+
+    def _submit_acquired(self, slots, url, html, allowed_tags, base_url):
+        """Hand a page to the workers once it holds a slot of `slots`."""
+        if not self.workers:
+            # The pool broke while this page waited
+            self._release(slots)
+            return self._submit_inline(url, html, allowed_tags, base_url)
+        executor = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_extract_timed, url, html, allowed_tags, base_url)
+        except BrokenProcessPool:
+            self._release(slots)
+            self.drop_broken(executor)
+            return self._submit_inline(url, html, allowed_tags, base_url)
+        except BaseException:
+            self._release(slots)
+            raise
+        future.add_done_callback(lambda _: self._release(slots))
+        return PendingExtraction(self, executor, url, html, allowed_tags, future, base_url)
+
+    def _release(self, slots):
+        """Free a slot and wake the coroutines waiting for one; they race for it."""
+        slots.release()
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # That crawl's event loop is already closed
+                pass
+
+    def drop_broken(self, broken):
+        """
+        Drop an executor whose worker died and extract inline from now on.
+        Forking replacements now could copy a lock held by another thread
+        into the new workers (see start()).
+        """
+        with self._lock:
+            if broken is None or self._executor is not broken:
+                return
+            self._executor = None
+            self.workers = 0
+        print("Extraction pool broken; pages are extracted inline from now on")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _completed(fn, *args):
+    """A finished Future holding fn(*args) or its exception."""
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,142 @@
+import asyncio
+import codecs
+import re
+
+import aiohttp
+
+# Default number of concurrent HTTP requests for the static fetch engine
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 15
+
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36 WebsiteAnalyzer/1.0"
+)
+
+# Pages with less visible text than this are assumed to need a browser
+MIN_TEXT_CHARS = 200
+# Error statuses worth retrying in the browser: bot blocks that let real browsers through
+BROWSER_RETRY_STATUSES = {403}
+
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_BODY_RE = re.compile(r'<body\b[^>]*>(.*)</body\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPA_MOUNT_RE = re.compile(
+    r'<div[^>]+id=["\'](root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>',
+    re.IGNORECASE
+)
+_NOSCRIPT_JS_RE = re.compile(r'<noscript\b[^>]*>[^<]*(enable|requires?)\s+javascript', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# Page bodies are read in chunks of this size, stopping once over the size limit
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def create_session(concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """Create a pooled keep-alive aiohttp session for static page fetches."""
+    connector = aiohttp.TCPConnector(
+        limit=concurrency,
+        ttl_dns_cache=300,
+        keepalive_timeout=30
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={'User-Agent': USER_AGENT}
+    )
+
+
+def content_skip_reason(content_type, content_length=None, max_bytes=None):
+    """
+    Decide from response headers whether a page should not be loaded.
+
+    Returns:
+        None for an HTML page within max_bytes (or of unknown type or
+        size), otherwise the reason, e.g. 'content type: application/pdf'.
+    """
+    mime_type = (content_type or '').split(';')[0].strip().lower()
+    if mime_type and 'html' not in mime_type:
+        return f"content type: {mime_type}"
+    try:
+        length = int(content_length) if content_length is not None else None
+    except ValueError:
+        length = None
+    if max_bytes is not None and length is not None and length > max_bytes:
+        return f"too large: {length} bytes"
+    return None
+
+
+def decode_html(body, charset=None):
+    """Decode an HTML body with the header charset, else its <meta> charset, else UTF-8."""
+    if not charset:
+        match = _META_CHARSET_RE.search(body[:4096])
+        charset = match.group(1).decode('ascii') if match else None
+    try:
+        codecs.lookup(charset or 'utf-8')
+    except LookupError:
+        charset = None
+    return body.decode(charset or 'utf-8', errors='replace')
+
+
+async def fetch_html(session, url, headers=None, max_bytes=None):
+    """
+    Fetch a single page over plain HTTP.
+
+    The body is only downloaded for HTML responses, and the download stops
+    as soon as it exceeds max_bytes.
+
+    Args:
+        session: An aiohttp ClientSession (see create_session).
+        url: The URL to fetch.
+        headers: Extra request headers, e.g. conditional-request validators.
+        max_bytes: Largest page body to accept (optional).
+
+    Returns:
+        A tuple (status, html, response_headers, skip_reason, final_url).
+        html is None when the request failed, the server answered 304, or
+        the page was skipped; skip_reason then says why, as in
+        content_skip_reason. final_url is the URL after redirects, which
+        relative links on the page resolve against.
+    """
+    try:
+        async with session.get(url, allow_redirects=True, headers=headers) as response:
+            final_url = str(response.url)
+            if response.status >= 300:
+                return response.status, None, response.headers, None, final_url
+            reason = content_skip_reason(response.headers.get('Content-Type'),
+                                         response.headers.get('Content-Length'), max_bytes)
+            if reason:
+                return response.status, None, response.headers, reason, final_url
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+                body += chunk
+                if max_bytes is not None and len(body) > max_bytes:
+                    return response.status, None, response.headers, f"too large: over {max_bytes} bytes", final_url
+            return response.status, decode_html(bytes(body), response.charset), response.headers, None, final_url
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Static fetch failed for {url}: {e}")
+        return None, None, {}, None, url
+
+
+def looks_js_rendered(html):
+    """
+    Heuristically decide whether static HTML needs a browser to render.
+
+    A page is considered JS-rendered when it has no body text, carries an
+    empty single-page-app mount point, or asks the visitor to enable
+    JavaScript while showing almost no content.
+    """
+    if not html or not html.strip():
+        return True
+
+    match = _BODY_RE.search(html)
+    body = match.group(1) if match else html
+    if _SPA_MOUNT_RE.search(body):
+        return True
+
+    visible = _TAG_RE.sub(' ', _SCRIPT_STYLE_RE.sub(' ', body))
+    text_length = len(' '.join(visible.split()))
+    if text_length < MIN_TEXT_CHARS:
+        return True
+
+    return bool(_NOSCRIPT_JS_RE.search(body)) and text_length < MIN_TEXT_CHARS * 5
@@ -0,0 +1,222 @@
+from collections import deque
+from urllib.parse import urldefrag, urlparse, urlunparse, parse_qsl, urlencode
+
+from content_guard import extension_skip_reason
+from url_registry import BloomFilter, FingerprintSet, LinkLog, url_fingerprint
+
+# Query parameters that only track campaigns/sessions and never change content
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', '_hsenc', '_hsmi', 'igshid', 'ref_src', 'sessionid', 'phpsessid'
+}
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """
+    Normalize a URL so that trivially different spellings map to one key.
+
+    Lowercases scheme and host, drops default ports, fragments and tracking
+    parameters, sorts the query string and strips trailing slashes from
+    non-root paths.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    port = parsed.port
+    if ':' in host:
+        # IPv6 literal
+        host = f"[{host}]"
+    netloc = host
+    if port and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{host}:{port}"
+
+    path = parsed.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    ]
+    query.sort()
+
+    return urlunparse((scheme, netloc, path, parsed.params, urlencode(query), ''))
+
+
+def domain_host(domain):
+    """
+    The bare hostname of an allowed-domains entry, which may be written as
+    a host, a host:port or a URL. Lowercase, without userinfo or port.
+    """
+    domain = domain.strip()
+    if '//' not in domain:
+        domain = '//' + domain
+    try:
+        return (urlparse(domain).hostname or '').rstrip('.')
+    except ValueError:
+        return ''
+
+
+def domain_allowed(url, allowed_hosts):
+    """
+    Whether a URL's host is one of `allowed_hosts` (see domain_host) or a
+    subdomain of one. Ports and userinfo are ignored.
+    """
+    try:
+        host = (urlparse(url).hostname or '').rstrip('.')
+    except ValueError:
+        return False
+    return any(host == d or host.endswith('.' + d) for d in allowed_hosts)
+
+
+class Frontier:
+    """
+    Breadth-first crawl frontier.
+
+    URLs are deduplicated by their canonical form when they are enqueued,
+    so each page is fetched at most once and at the shallowest depth it was
+    found. The canonical form is only the key: URLs are queued and logged
+    as first discovered (without the fragment), since a server may not
+    serve the canonical spelling (e.g. `/docs` for `/docs/`).
+
+    Seen URLs are kept as 64-bit fingerprints, and every newly seen in-scope
+    URL is appended once to `links`, the crawl's link log (a temporary one
+    unless an open LinkLog is passed in). With
+    `bloom_capacity`, links beyond max_depth (seen but never fetched) go to
+    a Bloom filter sized for that many URLs instead of the exact set; a
+    false positive there only drops a link from the log.
+
+    Links to non-HTML files (by extension) are logged but never queued;
+    they are passed to `on_skip(url, reason)` if set. Only queued URLs
+    count against `max_pages`, and refund() gives back the budget of a
+    URL that was handed out but turned out not to be a page.
+    """
+
+    def __init__(self, max_depth=3, max_pages=None, allowed_domains=None, bloom_capacity=None, links=None):
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.allowed_domains = allowed_domains
+        self._allowed_hosts = [host for host in map(domain_host, allowed_domains or ()) if host]
+        self.dequeued = 0
+        self.links = links if links is not None else LinkLog()
+        self._queue = deque()
+        self._seen = FingerprintSet()
+        self._beyond = BloomFilter(bloom_capacity) if bloom_capacity else None
+        self._domain_cache = {}
+        self.on_skip = None
+
+    def __len__(self):
+        if self.budget_exhausted():
+            return 0
+        return len(self._queue)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def budget_exhausted(self):
+        """Return True once max_pages URLs have been handed out."""
+        return self.max_pages is not None and self.dequeued >= self.max_pages
+
+    def in_scope(self, url):
+        """Check scheme and allowed domains, caching the domain decision per host."""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            return False
+        if not self.allowed_domains:
+            return True
+        netloc = parsed.netloc
+        allowed = self._domain_cache.get(netloc)
+        if allowed is None:
+            allowed = domain_allowed(url, self._allowed_hosts)
+            self._domain_cache[netloc] = allowed
+        return allowed
+
+    def mark_seen(self, url):
+        """Record a URL as already handled without queueing or logging it."""
+        self._seen.add(url_fingerprint(canonicalize_url(url)))
+
+    def seen(self, url):
+        fingerprint = url_fingerprint(canonicalize_url(url))
+        return fingerprint in self._seen or (self._beyond is not None and fingerprint in self._beyond)
+
+    def add(self, url, depth):
+        """
+        Offer a discovered URL to the frontier.
+
+        Returns:
+            The canonical URL if it is in scope (whether or not it was newly
+            queued), or None if it is outside the allowed domains.
+        """
+        if not self.in_scope(url):
+            return None
+        url = urldefrag(url.strip())[0]
+        canonical = canonicalize_url(url)
+        fingerprint = url_fingerprint(canonical)
+        if depth > self.max_depth and self._beyond is not None:
+            if fingerprint not in self._seen and self._beyond.add(fingerprint):
+                self.links.append(url)
+        elif self._seen.add(fingerprint):
+            self.links.append(url)
+            if depth <= self.max_depth:
+                reason = extension_skip_reason(url)
+                if reason is None:
+                    self._queue.append((url, depth))
+                elif self.on_skip is not None:
+                    self.on_skip(url, reason)
+        return canonical
+
+    def refund(self):
+        """Give back the page budget of a URL handed out by pop() that was not crawled."""
+        self.dequeued = max(self.dequeued - 1, 0)
+
+    def snapshot(self, pending=()):
+        """
+        Serializable state of the frontier for a checkpoint.
+
+        `pending` holds (url, depth) pairs already popped but not yet
+        fetched; they are queued first again when the state is restored.
+        The link log is not copied: only its length is recorded, so it must
+        be a log kept on disk that is reopened with that state on restore.
+        """
+        pending = list(pending)
+        return {
+            'queue': [list(item) for item in pending] + [list(item) for item in self._queue],
+            'seen': self._seen.to_state(),
+            'beyond': self._beyond.to_state() if self._beyond is not None else None,
+            'links': self.links.to_state(),
+            'dequeued': max(self.dequeued - len(pending), 0),
+        }
+
+    def restore(self, state):
+        """
+        Load a state written by snapshot() into a new frontier, whose link
+        log was reopened from state['links'].
+        """
+        self._queue = deque((url, depth) for url, depth in state['queue'])
+        self._seen = FingerprintSet.from_state(state['seen'])
+        if state['beyond'] is not None:
+            self._beyond = BloomFilter.from_state(state['beyond'])
+        if isinstance(state['links'], list):
+            # Checkpoints written before the link log was kept on disk
+            self.links.extend(state['links'])
+        self.dequeued = state['dequeued']
+
+    def pop(self):
+        """Return the next (url, depth) pair, or None if empty or over budget."""
+        if not self:
+            return None
+        self.dequeued += 1
+        return self._queue.popleft()
+
+    def pop_batch(self, size):
+        """Return up to `size` (url, depth) pairs in breadth-first order."""
+        batch = []
+        while len(batch) < size:
+            item = self.pop()
+            if item is None:
+                break
+            batch.append(item)
+        return batch
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_LLM_CACHE_PATH = os.path.join('cache', 'llm_cache.db')
+# Cached completions older than this are treated as misses and evicted
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 5000
+# Run eviction after this many writes
+EVICT_EVERY = 50
+
+
+def normalize_text(text):
+    """Collapse whitespace so prompts that differ only in spacing share a key."""
+    return ' '.join(text.split())
+
+
+def request_key(model, messages, params=None):
+    """
+    Cache key for a chat completion request.
+
+    Args:
+        model: The model name.
+        messages: The chat messages (dicts with role and content).
+        params: Sampling parameters such as temperature, max_tokens and seed.
+
+    Returns:
+        A hex digest over the model, the normalized messages and the parameters.
+    """
+    payload = {
+        'model': model,
+        'messages': [{'role': m['role'], 'content': normalize_text(m['content'])} for m in messages],
+        'params': params or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent on-disk cache of LLM completions keyed by request_key().
+
+    Entries expire after `ttl` seconds; beyond `max_entries` the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_LLM_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                response BLOB NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)')
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """Return the cached completion text for a key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT created_at, response FROM completions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or time.time() - row[0] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE completions SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        return zlib.decompress(row[1]).decode('utf-8')
+
+    def put(self, key, model, response):
+        """Store or replace a completion."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO completions (key, model, created_at, last_access, response) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, model, now, now, zlib.compress(response.encode('utf-8')))
+            )
+            self._conn.commit()
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY == 0
+
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones beyond max_entries."""
+        with self._lock:
+            self._conn.execute('DELETE FROM completions WHERE created_at < ?', (time.time() - self.ttl,))
+            self._conn.execute(
+                'DELETE FROM completions WHERE key IN '
+                '(SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
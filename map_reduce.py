@@ -0,0 +1,243 @@
+import asyncio
+import os
+import random
+import time
+
+import openai
+
+from ai_analyzer import (ANALYSIS_MODEL, ANALYSIS_PARAMS, analysis_messages, clean_lines, llm_cache)
+from context_selection import chunk_pages, count_tokens
+from llm_cache import request_key
+from metrics import span, record_llm_tokens, CACHE_REQUESTS
+from politeness import parse_retry_after
+
+# Concurrent LLM requests in flight for one analysis
+DEFAULT_MAP_CONCURRENCY = 8
+# Website content tokens sent in each map request
+MAP_INPUT_TOKENS = 2500
+# Upper bound on map requests per analysis; later pages are left out beyond it
+MAX_MAP_CALLS = 60
+# Notes larger than this are merged in another map pass before the final report
+REDUCE_INPUT_TOKENS = 6000
+MAX_RETRIES = 5
+# Errors that are worth retrying after a pause
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                    openai.InternalServerError)
+
+MAP_PARAMS = {'temperature': 0, 'max_tokens': 400}
+
+MAP_PROMPT = """Extract the facts from the following website pages that are relevant to:
+
+1. Company/Website Description
+2. Key Offerings and Features
+3. Market Positioning & Differentiators
+4. Target Sectors & Use Cases
+5. Team Members (names and roles)
+6. Company Location (addresses, cities, countries)
+
+Write short factual bullet points grouped under these headings, and leave out headings with no facts. Do not invent anything.
+
+Website Pages:
+{content}
+"""
+
+MERGE_PROMPT = """Merge the following notes about one website into a single set of bullet points under the same headings. Remove repetition and keep every distinct fact.
+
+Notes:
+{content}
+"""
+
+
+def create_async_client():
+    """
+    Async OpenAI client; OPENAI_BASE_URL points it at any OpenAI-compatible server.
+
+    The client's own retries are off because LLMRunner retries and paces requests itself.
+    """
+    return openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=os.getenv('OPENAI_BASE_URL') or None,
+                              max_retries=0)
+
+
+def group_pages(pages, max_tokens=MAP_INPUT_TOKENS):
+    """
+    Pack pages into map inputs of at most `max_tokens` tokens.
+
+    Pages stay in crawl order, so neighbouring pages of the same site
+    section share a request. Pages larger than the limit are split.
+
+    Returns:
+        A list of strings, each holding one or more pages under "Source:" lines.
+    """
+    groups = []
+    parts = []
+    used = 0
+    for chunk in chunk_pages(pages, chunk_tokens=max_tokens):
+        text = f"Source: {chunk['url']}\n{chunk['text']}"
+        tokens = chunk['tokens'] + count_tokens(chunk['url']) + 2
+        if parts and used + tokens > max_tokens:
+            groups.append('\n\n'.join(parts))
+            parts, used = [], 0
+        parts.append(text)
+        used += tokens
+    if parts:
+        groups.append('\n\n'.join(parts))
+    return groups
+
+
+class LLMRunner:
+    """
+    Issues chat completions concurrently with a cap on requests in flight.
+
+    Rate-limit, timeout, connection and server errors are retried with
+    exponential backoff and jitter. A 429 pauses every request of the
+    runner until its Retry-After has passed, not only the one that got it.
+    Completions go through the LLM cache like synchronous calls do.
+    """
+
+    def __init__(self, client=None, concurrency=DEFAULT_MAP_CONCURRENCY, model=ANALYSIS_MODEL,
+                 max_retries=MAX_RETRIES, use_cache=True):
+        self.client = client if client is not None else create_async_client()
+        self.model = model
+        self.max_retries = max_retries
+        self.cache = llm_cache if use_cache else None
+        self.calls = 0
+        self.cached = 0
+        self.retries = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._blocked_until = 0.0
+
+    async def complete(self, messages, params=None, on_token=None):
+        """
+        Return the completion text for a request, from the cache when possible.
+
+        on_token, if given, receives the text as it streams in.
+        """
+        params = ANALYSIS_PARAMS if params is None else params
+        key = request_key(self.model, messages, params) if self.cache is not None else None
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            CACHE_REQUESTS.inc(cache='llm', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                self.cached += 1
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+
+        async with self._semaphore:
+            with span('llm', model=self.model):
+                text, usage = await self._create(messages, params, on_token)
+        record_llm_tokens(messages, text, usage)
+        if self.cache is not None and text:
+            self.cache.put(key, self.model, text)
+        return text
+
+    async def _create(self, messages, params, on_token=None):
+        attempt = 0
+        while True:
+            delay = self._blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                self.calls += 1
+                if on_token is None:
+                    response = await self.client.chat.completions.create(model=self.model, messages=messages,
+                                                                         **params)
+                    return response.choices[0].message.content, response.usage
+                parts = []
+                stream = await self.client.chat.completions.create(model=self.model, messages=messages,
+                                                                   stream=True, **params)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+                return ''.join(parts), None
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                delay = min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+                if isinstance(e, openai.RateLimitError):
+                    retry_after = parse_retry_after(e.response.headers.get('retry-after'))
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                print(f"LLM request failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+async def _map(runner, groups, prompt):
+    messages = [[{"role": "user", "content": prompt.format(content=group)}] for group in groups]
+    return await asyncio.gather(*(runner.complete(m, MAP_PARAMS) for m in messages))
+
+
+async def analyze_map_reduce_async(pages, runner, on_token=None):
+    """
+    Summarize groups of pages concurrently, merge the notes, then write the report.
+
+    on_token, if given, receives the report text as it streams in.
+
+    Returns:
+        The six-section analysis text.
+    """
+    seen = set()
+    cleaned_pages = [(url, '\n'.join(clean_lines(text, seen))) for url, text in pages]
+    groups = group_pages(cleaned_pages)
+    if len(groups) > MAX_MAP_CALLS:
+        print(f"Analyzing the first {MAX_MAP_CALLS} of {len(groups)} page groups")
+        groups = groups[:MAX_MAP_CALLS]
+
+    print(f"Map step: {len(groups)} requests for {len(pages)} pages")
+    notes = await _map(runner, groups, MAP_PROMPT)
+
+    # Merge notes until they fit in the final prompt
+    while len(notes) > 1 and sum(count_tokens(note) for note in notes) > REDUCE_INPUT_TOKENS:
+        groups = group_pages([(f"notes {i + 1}", note) for i, note in enumerate(notes)], REDUCE_INPUT_TOKENS // 2)
+        if len(groups) >= len(notes):
+            break
+        print(f"Merging {len(notes)} notes in {len(groups)} requests")
+        notes = await _map(runner, groups, MERGE_PROMPT)
+
+    print("Reduce step: writing the report")
+    return await runner.complete(analysis_messages('\n\n'.join(notes)), on_token=on_token)
+
+
+def analyze_website_map_reduce(pages, concurrency=DEFAULT_MAP_CONCURRENCY, client=None, use_cache=True,
+                               on_token=None):
+    """
+    Analyze a whole site with the map-reduce strategy.
+
+    Args:
+        pages (list): (url, text) pairs for the crawled pages
+        concurrency (int): Maximum LLM requests in flight
+        client: An openai.AsyncOpenAI client, created from the environment if not given
+        use_cache (bool): Read and write the LLM cache
+        on_token (callable, optional): Receives the report text as it streams in
+
+    Returns:
+        dict: The same structure as analyze_website_content
+    """
+    if not pages:
+        return {'success': False, 'error': 'No content provided for analysis'}
+
+    async def run():
+        runner = LLMRunner(client, concurrency=concurrency, use_cache=use_cache)
+        try:
+            analysis = await analyze_map_reduce_async(pages, runner, on_token)
+        finally:
+            if client is None:
+                await runner.client.close()
+        print(f"Map-reduce analysis finished: {runner.calls} API calls, {runner.cached} cached, "
+              f"{runner.retries} retries")
+        return analysis, runner.calls == 0
+
+    try:
+        print("\nStarting map-reduce AI analysis...")
+        started = time.time()
+        analysis, cached = asyncio.run(run())
+        print(f"Map-reduce analysis took {time.time() - started:.1f}s")
+        return {'success': True, 'analysis': analysis, 'cached': cached}
+    except Exception as e:
+        print(f"Error in AI analysis: {str(e)}")
+        return {'success': False, 'error': str(e)}
@@ -0,0 +1,291 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from context_selection import count_tokens
+from task_queue import TaskCancelled
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Spans kept per task trace; later ones are only counted
+MAX_TRACE_SPANS = 20000
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, per label set."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.count(self.name + _format_labels(self.labelnames, key), amount)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, or is read from a callback at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                for key, value in self.callback().items():
+                    self.set(value, **dict(zip(self.labelnames, key if isinstance(key, tuple) else (key,))))
+            except Exception as e:
+                print(f"Gauge {self.name} callback failed: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum, per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last is +Inf), then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'crawler_stage_seconds', 'Time spent in each pipeline stage', ('stage',))
+PAGES = REGISTRY.counter(
+    'crawler_pages_total', 'Pages fetched, by where they came from (network, browser, cache)', ('source',))
+BYTES = REGISTRY.counter(
+    'crawler_bytes_total', 'Characters of HTML fetched, by where they came from', ('source',))
+ERRORS = REGISTRY.counter(
+    'crawler_errors_total', 'Failures, by pipeline stage', ('stage',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'crawler_cache_requests_total', 'Page and LLM cache lookups, by result (hit, miss, revalidated)',
+    ('cache', 'result'))
+LLM_TOKENS = REGISTRY.counter(
+    'llm_tokens_total', 'Tokens sent to and received from the model', ('direction',))
+SKIPPED = REGISTRY.counter(
+    'crawler_skipped_urls_total', 'URLs not crawled, by reason (robots.txt, extension, content type, too large...)',
+    ('reason',))
+TASKS = REGISTRY.counter(
+    'crawler_tasks_total', 'Finished tasks, by final status', ('status',))
+
+
+class Trace:
+    """Spans and counters recorded for one task, dumped as JSON when it ends."""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, started, seconds, attrs):
+        with self._lock:
+            if len(self.spans) >= MAX_TRACE_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append({'stage': stage, 'start': round(started - self._origin, 6),
+                               'seconds': round(seconds, 6), **attrs})
+
+    def count(self, name, amount):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """Count, total and maximum seconds per stage."""
+        stages = {}
+        with self._lock:
+            for span in self.spans:
+                stage = stages.setdefault(span['stage'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                stage['count'] += 1
+                stage['seconds'] += span['seconds']
+                stage['max_seconds'] = max(stage['max_seconds'], span['seconds'])
+        for stage in stages.values():
+            stage['seconds'] = round(stage['seconds'], 6)
+        return stages
+
+    def dump(self, path):
+        with self._lock:
+            data = {
+                'task_id': self.task_id,
+                'started': self.started,
+                'seconds': round(time.perf_counter() - self._origin, 6),
+                'counters': dict(self.counters),
+                'dropped_spans': self.dropped,
+                'spans': list(self.spans),
+            }
+        data['stages'] = self.summary()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+
+def current_trace():
+    """The trace of the task running in this context, or None."""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_task(task_id, trace_dir=None):
+    """
+    Record the spans and counters of everything run inside the block.
+
+    The trace follows the context into asyncio tasks; code on other
+    threads takes it explicitly (see span). When `trace_dir` is given the
+    trace is written there as <task_id>.trace.json at the end.
+    """
+    trace = Trace(task_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if trace_dir:
+            try:
+                os.makedirs(trace_dir, exist_ok=True)
+                trace.dump(os.path.join(trace_dir, f'{task_id}.trace.json'))
+            except OSError as e:
+                print(f"Could not write trace for {task_id}: {e}")
+
+
+@contextmanager
+def span(stage, trace=None, **attrs):
+    """
+    Time a block as one `stage` span.
+
+    The duration goes to the crawler_stage_seconds histogram and, with its
+    attributes, to the current task trace (or `trace`, for threads the
+    context does not reach). An exception leaving the block is counted in
+    crawler_errors_total.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except TaskCancelled:
+        # Cancellation is not a failure of the stage
+        raise
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record_span(stage, started, time.perf_counter() - started, trace, **attrs)
+
+
+def record_span(stage, started, seconds, trace=None, **attrs):
+    """Record a span timed elsewhere, such as in an extraction worker process."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = trace if trace is not None else _current_trace.get()
+    if trace is not None:
+        trace.add(stage, started, seconds, attrs)
+
+
+def record_llm_tokens(messages, text, usage=None):
+    """Count the tokens of a completion, from the API's usage report when there is one."""
+    if usage is not None:
+        prompt, completion = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt = sum(count_tokens(message['content']) for message in messages)
+        completion = count_tokens(text or '')
+    LLM_TOKENS.inc(prompt, direction='prompt')
+    LLM_TOKENS.inc(completion, direction='completion')
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from dataclasses import asdict
+
+from extraction import PageDocument
+from frontier import canonicalize_url
+
+DEFAULT_CACHE_PATH = os.path.join('cache', 'page_cache.db')
+# Entries younger than this are reused without touching the network
+DEFAULT_TTL = 24 * 60 * 60
+# Entries not refreshed for this long are evicted outright
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+# Run size-based eviction after this many writes
+EVICT_EVERY = 100
+
+CacheEntry = namedtuple('CacheEntry', 'url body_hash etag last_modified fetched_at html document')
+
+
+def body_hash(html):
+    """Content address of a page body."""
+    return hashlib.sha256(html.encode('utf-8', errors='replace')).hexdigest()
+
+
+def tags_key(allowed_tags):
+    """Key identifying the content filters a cached document was extracted with."""
+    return ','.join(allowed_tags) if allowed_tags else ''
+
+
+class PageCache:
+    """
+    Persistent on-disk cache of fetched pages keyed by canonical URL.
+
+    Each entry keeps the compressed HTML, its body hash, the ETag and
+    Last-Modified validators and the extracted PageDocument. Fresh entries
+    (younger than `ttl`) are used as-is; stale ones are revalidated with a
+    conditional request, and a 304 or an unchanged body hash reuses the
+    cached document without parsing again. Old and least recently used
+    entries are evicted to keep the file under `max_bytes`.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                body_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL,
+                html BLOB NOT NULL,
+                tags_key TEXT,
+                document BLOB
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)')
+        self._conn.commit()
+        self.evict()
+
+    def get(self, url, allowed_tags=None):
+        """
+        Look up a page.
+
+        Returns:
+            A CacheEntry, or None on a miss. `document` is only set when it
+            was extracted with the same content filters.
+        """
+        key = canonicalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body_hash, etag, last_modified, fetched_at, html, tags_key, document '
+                'FROM pages WHERE url = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE pages SET last_access = ? WHERE url = ?', (time.time(), key))
+            self._conn.commit()
+
+        digest, etag, last_modified, fetched_at, html, stored_tags, document = row
+        if document is not None and stored_tags == tags_key(allowed_tags):
+            document = PageDocument(**json.loads(zlib.decompress(document).decode('utf-8')))
+        else:
+            document = None
+        return CacheEntry(key, digest, etag, last_modified, fetched_at,
+                          zlib.decompress(html).decode('utf-8'), document)
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched_at < self.ttl
+
+    def conditional_headers(self, entry):
+        """Request headers that let the server answer 304 Not Modified."""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def mark_revalidated(self, url):
+        """Record that the server confirmed a cached page is unchanged."""
+        self.revalidated += 1
+        with self._lock:
+            self._conn.execute('UPDATE pages SET fetched_at = ? WHERE url = ?', (time.time(), canonicalize_url(url)))
+            self._conn.commit()
+
+    def put(self, url, html, document=None, allowed_tags=None, etag=None, last_modified=None):
+        """Store or replace a fetched page and its extracted document."""
+        html_blob = zlib.compress(html.encode('utf-8', errors='replace'))
+        doc_blob = zlib.compress(json.dumps(asdict(document)).encode('utf-8')) if document is not None else None
+        size = len(html_blob) + (len(doc_blob) if doc_blob else 0)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages (url, body_hash, etag, last_modified, fetched_at, '
+                'last_access, size, html, tags_key, document) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (canonicalize_url(url), body_hash(html), etag, last_modified, now, now, size,
+                 html_blob, tags_key(allowed_tags), doc_blob)
+            )
+            self._conn.commit()
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY == 0
+
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        with self._lock:
+            self._conn.execute('DELETE FROM pages WHERE fetched_at < ?', (time.time() - self.max_age,))
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+            if total > self.max_bytes:
+                cursor = self._conn.execute('SELECT url, size FROM pages ORDER BY last_access')
+                stale = []
+                for url, size in cursor:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((url,))
+                    total -= size
+                self._conn.executemany('DELETE FROM pages WHERE url = ?', stale)
+            self._conn.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from dataclasses import asdict
+
+from extraction import PageDocument
+
+
+class PageStore:
+    """
+    Append-only, disk-backed store of crawled pages for one task.
+
+    Pages are written as compressed JSON rows in a SQLite file as soon as
+    they are extracted, and read back in crawl order through a streaming
+    iterator, so memory use does not grow with the size of the site. The
+    store behaves like the content_map dict it replaces: it supports
+    `store[url] = doc`, `items()`, `len()` and `in`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        self._conn.commit()
+
+    def __setitem__(self, url, doc):
+        data = zlib.compress(json.dumps(asdict(doc)).encode('utf-8'))
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO pages (url, data) VALUES (?, ?)', (url, data))
+            self._conn.commit()
+
+    def __getitem__(self, url):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            raise KeyError(url)
+        return _decode(row[0])
+
+    def get(self, url, default=None):
+        try:
+            return self[url]
+        except KeyError:
+            return default
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM pages WHERE url = ?', (url,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __iter__(self):
+        for url, _ in self.items():
+            yield url
+
+    def items(self, batch_size=100):
+        """Yield (url, PageDocument) pairs in the order pages were stored."""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT seq, url, data FROM pages WHERE seq > ? ORDER BY seq LIMIT ?',
+                    (last_seq, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for seq, url, data in rows:
+                last_seq = seq
+                yield url, _decode(data)
+
+    def values(self):
+        for _, doc in self.items():
+            yield doc
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def delete(self):
+        """Close the store and remove its files from disk."""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def _decode(data):
+    return PageDocument(**json.loads(zlib.decompress(data).decode('utf-8')))
@@ -0,0 +1,321 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from fetcher import USER_AGENT
+from metrics import SKIPPED
+
+# Token name matched against User-agent lines in robots.txt
+ROBOTS_AGENT = "WebsiteAnalyzer"
+
+# Per-host defaults: steady request rate, burst size and concurrent requests
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_IN_FLIGHT = 6
+MIN_RATE = 0.1
+# Responses slower than this make us ease off the host
+SLOW_RESPONSE_SECONDS = 5.0
+# Statuses that mean "you are going too fast"
+BACKOFF_STATUSES = (429, 503)
+MAX_RETRIES = 2
+DEFAULT_RETRY_AFTER = 10.0
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RobotsCache:
+    """Fetches and caches robots.txt once per origin."""
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Return the RobotFileParser for the URL's origin, fetching it on first use."""
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            parser = self._parsers.get(origin)
+        if parser is not None:
+            return parser
+
+        robots_url = f"{origin}/robots.txt"
+        parser = RobotFileParser(robots_url)
+        try:
+            response = requests.get(robots_url, timeout=self.timeout, headers={'User-Agent': USER_AGENT})
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(response.text.splitlines())
+        except requests.RequestException as e:
+            print(f"Could not fetch {robots_url}: {e}")
+            parser.allow_all = True
+
+        with self._lock:
+            self._parsers.setdefault(origin, parser)
+        return parser
+
+    def allowed(self, url):
+        return self.get(url).can_fetch(ROBOTS_AGENT, url)
+
+    def crawl_delay(self, url):
+        delay = self.get(url).crawl_delay(ROBOTS_AGENT)
+        return float(delay) if delay else None
+
+    def sitemaps(self, url):
+        return self.get(url).site_maps() or []
+
+
+class _HostState:
+    def __init__(self, rate, burst):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.configured = False
+
+
+class HostScheduler:
+    """
+    Per-host politeness state shared by every crawl in the process.
+
+    Each host gets a token bucket (rate and burst), a cap on requests in
+    flight, the Crawl-delay and Disallow rules from its robots.txt, and an
+    adaptive rate that halves on 429/503 (honouring Retry-After), eases off
+    on slow responses and recovers gradually on success.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 respect_robots=True, robots=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.respect_robots = respect_robots
+        self.robots = robots if robots is not None else RobotsCache()
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        """Return the state for a URL's host; caller holds the lock."""
+        host = host_of(url)
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(self.rate, self.burst)
+            self._hosts[host] = state
+        return state
+
+    def prepare(self, url):
+        """Load robots.txt for the URL's host and apply its Crawl-delay (blocking, once per host)."""
+        with self._lock:
+            if self._host(url).configured:
+                return
+        delay = self.robots.crawl_delay(url) if self.respect_robots else None
+        with self._lock:
+            state = self._host(url)
+            if not state.configured and delay:
+                print(f"Honouring Crawl-delay of {delay}s for {host_of(url)}")
+                state.base_rate = state.rate = min(state.rate, 1.0 / delay)
+                state.burst = 1
+                state.tokens = min(state.tokens, 1.0)
+            state.configured = True
+
+    def allowed(self, url):
+        """Check robots.txt rules for a URL."""
+        if not self.respect_robots:
+            return True
+        self.prepare(url)
+        return self.robots.allowed(url)
+
+    def in_flight(self, host):
+        """Number of requests currently outstanding to a host."""
+        with self._lock:
+            state = self._hosts.get(host)
+            return state.in_flight if state is not None else 0
+
+    def reserve(self, url):
+        """
+        Take a request slot for the URL's host.
+
+        Returns:
+            The number of seconds the caller must wait before sending it.
+        """
+        with self._lock:
+            state = self._host(url)
+            now = time.monotonic()
+            state.tokens = min(state.burst, state.tokens + (now - state.updated) * state.rate)
+            state.updated = now
+            state.in_flight += 1
+
+            # Tokens may go negative: that is a reservation further in the future
+            wait = 0.0 if state.tokens >= 1 else (1 - state.tokens) / state.rate
+            state.tokens -= 1
+            return max(wait, state.blocked_until - now, 0.0)
+
+    async def acquire(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, url, status=None, elapsed=None, retry_after=None):
+        """
+        Record the outcome of a request and adapt the host's rate.
+
+        Returns:
+            True if the host asked us to slow down and the URL should be retried.
+        """
+        with self._lock:
+            state = self._host(url)
+            state.in_flight = max(state.in_flight - 1, 0)
+
+            if status in BACKOFF_STATUSES:
+                delay = parse_retry_after(retry_after)
+                if delay is None:
+                    delay = DEFAULT_RETRY_AFTER
+                state.rate = max(state.rate / 2, MIN_RATE)
+                state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+                print(f"Host {host_of(url)} answered {status}; backing off {delay:.1f}s "
+                      f"at {state.rate:.2f} req/s")
+                return True
+
+            if elapsed is not None and elapsed > SLOW_RESPONSE_SECONDS:
+                state.rate = max(state.rate * 0.75, MIN_RATE)
+            elif state.rate < state.base_rate:
+                state.rate = min(state.rate + 0.1 * state.base_rate, state.base_rate)
+            return False
+
+
+class HostQueues:
+    """
+    Per-host queues for one crawl, layered over its Frontier.
+
+    URLs are pulled from the frontier in breadth-first order, checked
+    against robots.txt and handed out round-robin across hosts, never
+    exceeding a host's in-flight limit, so one slow origin does not starve
+    the others.
+
+    URLs left out of the crawl are listed in `skipped` as (url, reason)
+    pairs, and passed to `on_skip(url, reason)` if set. They do not count
+    against the frontier's page budget.
+    """
+
+    def __init__(self, frontier, scheduler, lookahead=4, skipped=None):
+        self.frontier = frontier
+        self.scheduler = scheduler
+        self.lookahead = lookahead
+        self.skipped = skipped if skipped is not None else []
+        self.on_skip = None
+        self._queues = OrderedDict()
+        self._attempts = {}
+        self._pending = 0
+        # Links the frontier refuses to queue never used any budget
+        frontier.on_skip = lambda url, reason: self.skip(url, reason, counted=False)
+
+    def __len__(self):
+        return self._pending + len(self.frontier)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def _fill(self, size):
+        while self._pending < size * self.lookahead:
+            item = self.frontier.pop()
+            if item is None:
+                return
+            url, depth = item
+            if not self.scheduler.allowed(url):
+                print(f"Skipping {url}: disallowed by robots.txt")
+                self.skip(url, 'robots.txt')
+                continue
+            self._queues.setdefault(host_of(url), deque()).append(item)
+            self._pending += 1
+
+    def next_batch(self, size):
+        """Return up to `size` (url, depth) pairs spread across hosts."""
+        self._fill(size)
+        batch = []
+        taken = {}
+        while len(batch) < size and self._pending:
+            progressed = False
+            for host in list(self._queues):
+                queue = self._queues[host]
+                if not queue:
+                    del self._queues[host]
+                    continue
+                if taken.get(host, 0) + self.scheduler.in_flight(host) >= self.scheduler.max_in_flight:
+                    continue
+                batch.append(queue.popleft())
+                taken[host] = taken.get(host, 0) + 1
+                self._pending -= 1
+                progressed = True
+                if len(batch) >= size:
+                    break
+            if not progressed:
+                break
+        if not batch and self._pending:
+            # Every host is at its in-flight limit; hand out one URL anyway
+            # and let acquire() pace it.
+            host = next(host for host, queue in self._queues.items() if queue)
+            batch.append(self._queues[host].popleft())
+            self._pending -= 1
+        return batch
+
+    def pending_items(self):
+        """(url, depth) pairs taken from the frontier but not handed out yet."""
+        return [item for queue in self._queues.values() for item in queue]
+
+    def skip(self, url, reason, counted=True):
+        """
+        Record a URL that will not be crawled; reasons read like 'robots.txt'
+        or 'extension: .pdf'. `counted` URLs were taken from the frontier and
+        give their page budget back.
+        """
+        if counted:
+            self.frontier.refund()
+        self.skipped.append((url, reason))
+        SKIPPED.inc(reason=reason.split(':')[0])
+        if self.on_skip is not None:
+            self.on_skip(url, reason)
+
+    def retry(self, url, depth):
+        """Put a throttled URL back at the front of its host queue, up to MAX_RETRIES times."""
+        attempts = self._attempts.get(url, 0) + 1
+        self._attempts[url] = attempts
+        if attempts > MAX_RETRIES:
+            self.skip(url, 'rate limited')
+            return False
+        self._queues.setdefault(host_of(url), deque()).appendleft((url, depth))
+        self._pending += 1
+        return True
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from collections import deque
+
+# Events kept per task for clients that connect late or reconnect
+MAX_EVENTS_PER_TASK = 2000
+# Events of finished tasks are dropped after this many seconds
+FINISHED_RETENTION = 10 * 60
+
+
+class _TaskEvents:
+    def __init__(self):
+        self.events = deque(maxlen=MAX_EVENTS_PER_TASK)
+        self.next_id = 1
+        self.finished_at = None
+
+
+class ProgressHub:
+    """
+    In-process publish/subscribe of per-task progress events.
+
+    The crawl publishes events as it goes; each Server-Sent Events client
+    waits on a condition variable for events newer than the last id it
+    saw, so reconnecting clients resume where they left off.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._condition = threading.Condition()
+
+    def publish(self, task_id, event, **data):
+        with self._condition:
+            task = self._tasks.get(task_id)
+            if task is None:
+                self._prune()
+                task = self._tasks[task_id] = _TaskEvents()
+            task.events.append((task.next_id, event, data))
+            task.next_id += 1
+            self._condition.notify_all()
+
+    def finish(self, task_id):
+        """Mark a task's stream complete; waiting clients are released."""
+        with self._condition:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task.finished_at = time.time()
+            self._condition.notify_all()
+
+    def has_task(self, task_id):
+        with self._condition:
+            return task_id in self._tasks
+
+    def events_since(self, task_id, last_id=0, timeout=15.0):
+        """
+        Wait up to `timeout` seconds for events with an id above `last_id`.
+
+        Returns:
+            A tuple (list of (id, event, data), whether the task has finished).
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                task = self._tasks.get(task_id)
+                if task is not None:
+                    events = [item for item in task.events if item[0] > last_id]
+                    if events or task.finished_at is not None:
+                        return events, task.finished_at is not None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                self._condition.wait(remaining)
+
+    def _prune(self):
+        """Drop the events of tasks that finished a while ago; caller holds the lock."""
+        cutoff = time.time() - FINISHED_RETENTION
+        for task_id in [t for t, task in self._tasks.items() if task.finished_at and task.finished_at < cutoff]:
+            del self._tasks[task_id]
+
+
+def format_sse(event_id, event, data):
+    """Encode one Server-Sent Events message."""
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import zlib
+
+# zstd is offered when the zstandard package is installed, gzip always
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content encodings of downloads in order of preference, with the suffix of
+# their precompressed files
+ENCODINGS = [('zstd', '.zst'), ('gzip', '.gz')]
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+# Files are read and compressed in chunks of this size
+CHUNK_BYTES = 64 * 1024
+
+
+def page_record(doc):
+    """The JSON-serializable record of a page written to the NDJSON results."""
+    return {
+        'url': doc.url,
+        'title': doc.title,
+        'duplicate_of': doc.duplicate_of,
+        'links': doc.links,
+        'text': doc.content_text,
+    }
+
+
+class PageRecordWriter:
+    """
+    Results file that grows by one JSON line per page as the crawl
+    completes it, so it can be downloaded while the crawl is running.
+
+    Lines are flushed one at a time; a reader of a running crawl's file
+    may see the last line cut short and should drop it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def add(self, doc):
+        line = json.dumps(page_record(doc), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def available_encodings():
+    return [(name, suffix) for name, suffix in ENCODINGS if name != 'zstd' or zstandard is not None]
+
+
+def compress_file(path):
+    """
+    Write the precompressed variants of a finished file next to it
+    (`.gz`, and `.zst` with zstandard installed). Each is written under a
+    temporary name first, so a download never sees half a variant.
+    """
+    for name, suffix in available_encodings():
+        tmp_path = f"{path}{suffix}.tmp"
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+            if name == 'zstd':
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(source, target)
+            else:
+                with gzip.GzipFile(fileobj=target, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as compressed:
+                    shutil.copyfileobj(source, compressed, CHUNK_BYTES)
+        os.replace(tmp_path, path + suffix)
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows, ignoring those with q=0."""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            accepted.add(name)
+    if '*' in accepted:
+        accepted.update(name for name, _ in ENCODINGS)
+    return accepted
+
+
+def negotiate(path, accept_encoding):
+    """
+    Choose the precompressed variant of `path` to send.
+
+    Variants older than the file itself (still being written, or left
+    from an earlier run) are not used.
+
+    Returns:
+        (path to send, content coding) for a variant, or (path, None).
+    """
+    accepted = accepted_encodings(accept_encoding)
+    modified = os.path.getmtime(path)
+    for name, suffix in available_encodings():
+        variant = path + suffix
+        if name in accepted and os.path.isfile(variant) and os.path.getmtime(variant) >= modified:
+            return variant, name
+    return path, None
+
+
+def gzip_stream(path):
+    """Yield `path` gzip-compressed chunk by chunk, for files without a precompressed variant."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
@@ -0,0 +1,77 @@
+import os
+from collections import defaultdict
+
+from ai_analyzer import analyze_website_content
+from boilerplate import TemplateDetector
+from map_reduce import analyze_website_map_reduce, DEFAULT_MAP_CONCURRENCY
+from metrics import span
+
+# The analyzer only keeps a few thousand characters, so stop collecting its
+# input well before a large site's text would fill memory
+MAX_ANALYZER_INPUT_CHARS = 200000
+
+# 'select' sends the most relevant chunks in one request; 'map_reduce'
+# summarizes every page concurrently and writes the report from the notes
+ANALYSIS_MODES = ('select', 'map_reduce')
+DEFAULT_ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'select')
+ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', str(DEFAULT_MAP_CONCURRENCY)))
+
+
+def collect_pages(content_map, max_chars=MAX_ANALYZER_INPUT_CHARS):
+    """
+    Prepare crawled pages for the analyzer.
+
+    Near-duplicate pages are left out and the site template (menus,
+    footers, banners) is stripped from every page but the first.
+
+    Returns:
+        A tuple ((url, text) pairs up to max_chars of text in total,
+        dict mapping each original URL to the URLs of its near-duplicates).
+    """
+    pages = []
+    total_length = 0
+    duplicate_clusters = defaultdict(list)
+
+    print(f"Processing {len(content_map)} pages for analysis...")
+
+    # Learn the blocks repeated on every page (menus, footers, banners)
+    template_detector = TemplateDetector.fit(doc for doc in content_map.values() if not doc.duplicate_of)
+
+    for page_url, doc in content_map.items():
+        if doc.duplicate_of:
+            duplicate_clusters[doc.duplicate_of].append(page_url)
+            continue
+        if total_length >= max_chars:
+            # Budget full: the remaining pages only count for the duplicate clusters
+            continue
+        print(f"Processing page: {page_url}")
+        # Text was extracted once during the crawl, with the content filters applied.
+        # The first page keeps its template text so details that only
+        # appear in the footer (such as the address) still reach the analyzer.
+        text = template_detector.clean(doc) if pages else doc.content_text
+
+        if text.strip():  # Only add non-empty content
+            print(f"Found {len(text)} characters of content")
+            # The analyzer ranks the chunks of every page against each report
+            # section, so About, Team and Contact pages are found by content
+            pages.append((page_url, text))
+            total_length += len(text)
+        else:
+            print("No content found in page")
+
+    print(f"Total content length: {total_length} characters")
+    return pages, duplicate_clusters
+
+
+def run_analysis(pages, analysis_mode=DEFAULT_ANALYSIS_MODE, on_token=None):
+    """
+    Analyze the collected pages with the chosen analysis mode.
+
+    Returns:
+        dict: The result of analyze_website_content or analyze_website_map_reduce
+    """
+    with span('analysis', mode=analysis_mode):
+        if analysis_mode == 'map_reduce':
+            return analyze_website_map_reduce(pages, concurrency=ANALYSIS_CONCURRENCY, on_token=on_token)
+        combined_content = '\n\n'.join(text for _, text in pages)
+        return analyze_website_content(combined_content, pages=pages, on_token=on_token)
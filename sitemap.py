@@ -0,0 +1,163 @@
+import gzip
+import io
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
+
+from fetcher import USER_AGENT, DEFAULT_TIMEOUT
+
+# The sitemap protocol caps a file at 50,000 URLs and 50 MB uncompressed
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+# Sitemap files (indexes included) read for one site
+MAX_SITEMAP_FILES = 50
+# URLs read from a site's sitemaps at most
+MAX_SITEMAP_URLS = 50000
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class _LimitedReader(io.RawIOBase):
+    """File-like wrapper that fails once more than `limit` bytes were read."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise ValueError(f"sitemap larger than {MAX_SITEMAP_BYTES} bytes")
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def parse_lastmod(value):
+    """Parse a W3C datetime (2024-05-01 or 2024-05-01T10:00:00+00:00) into a Unix timestamp."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_sitemap(stream):
+    """
+    Stream the entries of a sitemap or sitemap index.
+
+    Elements are cleared as soon as they are read, so memory stays flat on
+    files with tens of thousands of URLs. Gzipped files are detected by
+    their magic bytes.
+
+    Yields:
+        ('url', loc, lastmod timestamp or None) for pages and
+        ('sitemap', loc, lastmod timestamp or None) for index entries.
+    """
+    reader = io.BufferedReader(_LimitedReader(stream, MAX_SITEMAP_BYTES))
+    if reader.peek(2)[:2] == _GZIP_MAGIC:
+        reader = io.BufferedReader(_LimitedReader(gzip.GzipFile(fileobj=reader), MAX_SITEMAP_BYTES))
+
+    root = None
+    for event, element in ET.iterparse(reader, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            continue
+        kind = _local_name(element.tag)
+        if kind not in ('url', 'sitemap'):
+            continue
+        loc = lastmod = None
+        for child in element:
+            name = _local_name(child.tag)
+            if name == 'loc':
+                loc = (child.text or '').strip()
+            elif name == 'lastmod':
+                lastmod = parse_lastmod(child.text)
+        root.clear()
+        if loc:
+            yield kind, loc, lastmod
+
+
+def sitemap_urls(start_url, robots=None):
+    """Sitemaps announced in the site's robots.txt, or /sitemap.xml when there are none."""
+    urls = robots.sitemaps(start_url) if robots is not None else []
+    if not urls:
+        parsed = urlparse(start_url)
+        urls = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+    return urls
+
+
+def iter_sitemap_entries(start_url, robots=None, scheduler=None, max_urls=MAX_SITEMAP_URLS,
+                         max_files=MAX_SITEMAP_FILES, timeout=DEFAULT_TIMEOUT):
+    """
+    Discover a site's sitemaps and yield the pages they list.
+
+    Sitemap indexes are followed breadth-first up to `max_files` files.
+    Files that are missing or malformed are skipped; entries read before
+    a parse error are kept.
+
+    Args:
+        start_url: Any URL of the site.
+        robots: A RobotsCache whose robots.txt Sitemap lines are used (optional).
+        scheduler: A HostScheduler the sitemap requests go through (optional).
+        max_urls: Stop after this many page URLs.
+        max_files: Stop after reading this many sitemap files.
+
+    Yields:
+        (page URL, lastmod Unix timestamp or None) pairs.
+    """
+    pending = deque(sitemap_urls(start_url, robots))
+    seen = set(pending)
+    files = 0
+    count = 0
+    with requests.Session() as session:
+        session.headers['User-Agent'] = USER_AGENT
+        while pending and files < max_files and count < max_urls:
+            url = pending.popleft()
+            files += 1
+            if scheduler is not None:
+                scheduler.acquire_sync(url)
+            started = time.monotonic()
+            status = None
+            try:
+                with session.get(url, stream=True, timeout=timeout) as response:
+                    status = response.status_code
+                    if status >= 400:
+                        print(f"No sitemap at {url} (HTTP {status})")
+                        continue
+                    # Transfer-encoded gzip is undone here; .xml.gz files are detected by parse_sitemap
+                    response.raw.decode_content = True
+                    for kind, loc, lastmod in parse_sitemap(response.raw):
+                        if kind == 'sitemap':
+                            if loc not in seen:
+                                seen.add(loc)
+                                pending.append(loc)
+                            continue
+                        yield loc, lastmod
+                        count += 1
+                        if count >= max_urls:
+                            break
+            except (requests.RequestException, ET.ParseError, ValueError, OSError, EOFError) as e:
+                print(f"Could not read sitemap {url}: {e}")
+            finally:
+                if scheduler is not None:
+                    scheduler.release(url, status, time.monotonic() - started)
+    print(f"Read {count} URLs from {files} sitemap files")
@@ -0,0 +1,163 @@
+import itertools
+import queue
+import threading
+import time
+
+# Default number of tasks that run at the same time
+DEFAULT_WORKERS = 2
+# Default number of tasks allowed to wait for a worker
+DEFAULT_MAX_QUEUED = 20
+# Default wall-clock limit for one task, in seconds
+DEFAULT_TASK_TIMEOUT = 30 * 60
+
+
+class QueueFull(Exception):
+    """Raised by TaskQueue.submit when no more tasks may wait."""
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task when it was cancelled or ran past its timeout."""
+
+
+class TaskHandle:
+    """
+    State of one submitted task, passed to the task function.
+
+    The task calls check() at safe points (between pages, before the
+    analysis) and stops when it raises TaskCancelled.
+    """
+
+    def __init__(self, task_id, priority=0, timeout=None):
+        self.task_id = task_id
+        self.priority = priority
+        self.timeout = timeout
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def timed_out(self):
+        return (self.timeout is not None and self.started_at is not None
+                and time.time() - self.started_at > self.timeout)
+
+    def check(self):
+        """Raise TaskCancelled if the task should stop."""
+        if self.cancelled:
+            raise TaskCancelled('Task was cancelled')
+        if self.timed_out():
+            raise TaskCancelled(f'Task exceeded its {self.timeout}s time limit')
+
+    def wait_time(self):
+        """Seconds spent waiting for a worker so far (or in total, once started)."""
+        return (self.started_at or time.time()) - self.submitted_at
+
+
+class TaskQueue:
+    """
+    Fixed pool of worker threads fed by a bounded priority queue.
+
+    Tasks with a lower priority number run first; equal priorities run in
+    submission order. submit() raises QueueFull instead of letting the
+    backlog grow without bound.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED, timeout=DEFAULT_TASK_TIMEOUT):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._handles = {}
+        self._waiting = []
+        self._running = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"task-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, task_id, fn, *args, priority=0, timeout=None, **kwargs):
+        """
+        Queue fn(*args, task=handle, **kwargs) to run on a worker.
+
+        Returns:
+            The task's TaskHandle.
+
+        Raises:
+            QueueFull: if max_queued tasks are already waiting.
+        """
+        handle = TaskHandle(task_id, priority, timeout if timeout is not None else self.timeout)
+        with self._lock:
+            if len(self._waiting) >= self.max_queued:
+                raise QueueFull(f"{len(self._waiting)} tasks are already waiting")
+            seq = next(self._counter)
+            self._handles[task_id] = handle
+            self._waiting.append((priority, seq, task_id))
+            self._waiting.sort()
+        self._queue.put((priority, seq, handle, fn, args, kwargs))
+        return handle
+
+    def get(self, task_id):
+        with self._lock:
+            return self._handles.get(task_id)
+
+    def position(self, task_id):
+        """1-based place of a waiting task in the queue, or None if it is not waiting."""
+        with self._lock:
+            for index, (_, _, waiting_id) in enumerate(self._waiting):
+                if waiting_id == task_id:
+                    return index + 1
+        return None
+
+    def cancel(self, task_id):
+        """
+        Cancel a task. A waiting task is dropped when it reaches a worker; a
+        running one stops at its next check().
+
+        Returns:
+            False if the task is unknown or already finished.
+        """
+        handle = self.get(task_id)
+        if handle is None or handle.finished_at is not None:
+            return False
+        handle.cancel()
+        return True
+
+    def stats(self):
+        with self._lock:
+            waits = [self._handles[task_id].wait_time() for _, _, task_id in self._waiting]
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'queued': len(self._waiting),
+                'max_queued': self.max_queued,
+                'oldest_wait': round(max(waits), 1) if waits else 0.0,
+            }
+
+    def _work(self):
+        while True:
+            priority, seq, handle, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._waiting.remove((priority, seq, handle.task_id))
+                self._running.add(handle.task_id)
+            handle.started_at = time.time()
+            try:
+                if not handle.cancelled:
+                    fn(*args, task=handle, **kwargs)
+            except Exception as e:
+                print(f"Task {handle.task_id} failed: {e}")
+            finally:
+                handle.finished_at = time.time()
+                with self._lock:
+                    self._running.discard(handle.task_id)
+                    # Finished tasks are forgotten here; their results are kept by the caller
+                    self._handles.pop(handle.task_id, None)
+                self._queue.task_done()
@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_TASK_DB_PATH = os.path.join('cache', 'tasks.db')
+# Finished tasks and their output files are removed after this many seconds
+DEFAULT_TASK_TTL = 7 * 24 * 60 * 60
+
+
+class MemoryTaskStore:
+    """
+    Task states kept in a process-local dict.
+
+    Fine for development with a single process; states are lost on restart
+    and are not visible to other workers.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def __setitem__(self, task_id, state):
+        with self._lock:
+            self._tasks[task_id] = (time.time(), dict(state))
+
+    def get(self, task_id, default=None):
+        with self._lock:
+            item = self._tasks.get(task_id)
+        return dict(item[1]) if item is not None else default
+
+    def __getitem__(self, task_id):
+        state = self.get(task_id)
+        if state is None:
+            raise KeyError(task_id)
+        return state
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def update(self, task_id, **fields):
+        """Merge fields into a task's state (creating it if needed)."""
+        with self._lock:
+            state = dict(self._tasks.get(task_id, (None, {}))[1])
+            state.update(fields)
+            self._tasks[task_id] = (time.time(), state)
+
+    def pop(self, task_id, default=None):
+        with self._lock:
+            item = self._tasks.pop(task_id, None)
+        return item[1] if item is not None else default
+
+    def expired(self, max_age):
+        """(task_id, state) pairs not updated for max_age seconds."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            return [(task_id, dict(state)) for task_id, (updated, state) in self._tasks.items() if updated < cutoff]
+
+    def close(self):
+        pass
+
+
+class SQLiteTaskStore:
+    """
+    Task states in a SQLite database in WAL mode.
+
+    Every web worker process opens the same file, so a task started by one
+    worker can be polled or cancelled through any other, and states survive
+    restarts.
+    """
+
+    def __init__(self, path=DEFAULT_TASK_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                state TEXT NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tasks_updated_at ON tasks (updated_at)')
+        self._conn.commit()
+
+    def __setitem__(self, task_id, state):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tasks (task_id, updated_at, state) VALUES (?, ?, ?)',
+                (task_id, time.time(), json.dumps(state))
+            )
+            self._conn.commit()
+
+    def get(self, task_id, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT state FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def __getitem__(self, task_id):
+        state = self.get(task_id)
+        if state is None:
+            raise KeyError(task_id)
+        return state
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def update(self, task_id, **fields):
+        """Merge fields into a task's state (creating it if needed)."""
+        with self._lock:
+            # BEGIN IMMEDIATE keeps concurrent read-modify-write cycles from other processes apart
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT state FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+                state = json.loads(row[0]) if row is not None else {}
+                state.update(fields)
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO tasks (task_id, updated_at, state) VALUES (?, ?, ?)',
+                    (task_id, time.time(), json.dumps(state))
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def pop(self, task_id, default=None):
+        state = self.get(task_id)
+        with self._lock:
+            self._conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+            self._conn.commit()
+        return state if state is not None else default
+
+    def expired(self, max_age):
+        """(task_id, state) pairs not updated for max_age seconds."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT task_id, state FROM tasks WHERE updated_at < ?', (time.time() - max_age,)
+            ).fetchall()
+        return [(task_id, json.loads(state)) for task_id, state in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_task_store(backend='sqlite', path=DEFAULT_TASK_DB_PATH):
+    """Build the task store named by `backend`: 'sqlite' (default) or 'memory'."""
+    if backend == 'memory':
+        return MemoryTaskStore()
+    if backend == 'sqlite':
+        return SQLiteTaskStore(path)
+    raise ValueError(f"Unknown task store backend: {backend}")
+
+
+def cleanup_expired_tasks(store, folder, max_age=DEFAULT_TASK_TTL):
+    """
+    Remove tasks not updated for max_age seconds together with their files in `folder`.
+
+    A task's files are the ones named in its state plus any file whose
+    name starts with its id.
+
+    Returns:
+        The number of tasks removed.
+    """
+    removed = 0
+    names = os.listdir(folder) if os.path.isdir(folder) else []
+    for task_id, state in store.expired(max_age):
+        files = {state.get(key) for key in ('links_file', 'content_file', 'analysis_file')}
+        files.update(name for name in names if name.startswith(task_id))
+        for name in files:
+            if not name:
+                continue
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Could not remove {path}: {e}")
+        store.pop(task_id)
+        removed += 1
+    if removed:
+        print(f"Removed {removed} expired tasks and their files")
+    return removed